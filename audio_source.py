@@ -0,0 +1,170 @@
+import platform
+import time
+from threading import Event, Thread, current_thread
+
+from alsa_suppress import noalsaerr
+from utils import *
+
+
+def to_device_layout(data):
+    """
+    Converts recorded audio to the 8-channel int16 layout of the UMA-8 stream.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+
+    if np.issubdtype(data.dtype, np.floating):
+        data = np.clip(data * 32768, -32768, 32767)
+    data = data.astype(np.int16)
+
+    # Recordings made with record.py do not include all 8 channels,
+    # so pad them with silent channels to look like the live device
+    if data.shape[1] < CHANNELS:
+        padding = np.zeros((data.shape[0], CHANNELS - data.shape[1]), dtype=np.int16)
+        data = np.hstack([data, padding])
+
+    return np.ascontiguousarray(data[:, :CHANNELS])
+
+
+def read_wav(path):
+    """
+    Reads a multichannel recording in the layout of the UMA-8 stream.
+    """
+    from scipy.io import wavfile
+
+    rate, data = wavfile.read(path)
+    if rate != RATE:
+        raise ValueError(f'{path} has a sample rate of {rate} Hz, expected {RATE} Hz')
+    return to_device_layout(data)
+
+
+def open_wav(path):
+    """
+    Memory-maps a recording, so frames of hours of audio can be read without loading all of it.
+    The length comes from the WAV header, convert the frames read with to_device_layout.
+    """
+    from scipy.io import wavfile
+
+    rate, data = wavfile.read(path, mmap=True)
+    if rate != RATE:
+        raise ValueError(f'{path} has a sample rate of {rate} Hz, expected {RATE} Hz')
+    return data
+
+
+class AudioSource:
+    """
+    Something that delivers blocks of 8-channel int16 audio
+    to a PyAudio-style stream callback.
+    """
+
+    def start(self, callback, frames_per_buffer=CHUNK):
+        raise NotImplementedError
+
+    def is_active(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class PyAudioSource(AudioSource):
+    """
+    Live input from a PortAudio device, the default input device unless specified.
+    """
+
+    def __init__(self, device_index=None):
+        if platform.system() == 'Windows':
+            self.p = pyaudio.PyAudio()
+        else:
+            with noalsaerr():
+                self.p = pyaudio.PyAudio()
+
+        self.device_index = device_index
+        self.stream = None
+
+    def start(self, callback, frames_per_buffer=CHUNK):
+        self.stream = self.p.open(
+            format=FORMAT, channels=CHANNELS, rate=RATE, input=True, input_device_index=self.device_index,
+            frames_per_buffer=frames_per_buffer, stream_callback=callback
+        )
+        self.stream.start_stream()
+
+    def is_active(self):
+        return self.stream is not None and self.stream.is_active()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.p.terminate()
+
+
+class ReplaySource(AudioSource):
+    """
+    Replays recorded multichannel audio through the stream callback, either paced
+    like a live device (realtime=True) or as fast as the callback returns.
+    """
+
+    def __init__(self, data, realtime=True, loop=False):
+        self.data = to_device_layout(data)
+        self.realtime = realtime
+        self.loop = loop
+
+        self.thread = None
+        self.stopped = Event()
+        self.finished = Event()
+
+    @classmethod
+    def from_wav(cls, path, realtime=True, loop=False):
+        return cls(read_wav(path), realtime, loop)
+
+    def start(self, callback, frames_per_buffer=CHUNK):
+        self.stopped.clear()
+        self.finished.clear()
+        self.thread = Thread(target=self.replay, args=(callback, frames_per_buffer), daemon=True)
+        self.thread.start()
+
+    def replay(self, callback, frames_per_buffer):
+        n_blocks = len(self.data) // frames_per_buffer
+        start_time = time.perf_counter()
+        delivered = 0
+
+        while n_blocks and not self.stopped.is_set():
+            block = delivered % n_blocks
+            if block == 0 and delivered and not self.loop:
+                break
+
+            # A live stream hands over each block only after it has been fully captured
+            stream_time = (delivered + 1) * frames_per_buffer / RATE
+            if self.realtime:
+                delay = start_time + stream_time - time.perf_counter()
+                if delay > 0 and self.stopped.wait(delay):
+                    break
+
+            in_data = self.data[block * frames_per_buffer:(block + 1) * frames_per_buffer].tobytes()
+            time_info = {'input_buffer_adc_time': stream_time - frames_per_buffer / RATE,
+                         'current_time': time.perf_counter() - start_time,
+                         'output_buffer_dac_time': 0}
+            _, flag = callback(in_data, frames_per_buffer, time_info, 0)
+            delivered += 1
+
+            if flag != PA_CONTINUE:
+                break
+
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the whole recording has been replayed.
+        """
+        return self.finished.wait(timeout)
+
+    def is_active(self):
+        return self.thread is not None and not self.finished.is_set()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None and self.thread is not current_thread():
+            self.thread.join()
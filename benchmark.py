@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+"""
+Per-stage latency benchmark of the DOA pipeline on synthetic audio.
+
+Usage: python3 benchmark.py [--repeats N] [--output benchmark.json] [--tpu]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+from functools import lru_cache
+
+from audio_source import ReplaySource
+from multi_source_predictor import MultiSourcePredictor
+from music import MIC_RADIUS, SPEED_OF_SOUND
+from predictor import get_mic_data, get_input_matrix
+from single_source_predictor import SingleSourcePredictor
+from utils import *
+
+def synthetic_chunk(azimuth, rng, amplitude=200):
+    """
+    Simulates a far-field white noise source at the given azimuth (in degrees)
+    and packs it into an 8-channel int16 buffer, laid out like the UMA-8 stream.
+    """
+    n = 2 * CHUNK
+    source = np.fft.rfft(rng.standard_normal(n))
+    freqs = np.fft.rfftfreq(n, 1 / RATE)
+
+    mic_angles = np.radians(np.arange(0, 360, 60))
+    delays = -MIC_RADIUS * np.cos(math.radians(azimuth) - mic_angles) / SPEED_OF_SOUND
+    mic_signals = np.fft.irfft(source * np.exp(-2j * math.pi * freqs * delays[:, np.newaxis]), n=n)[:, :CHUNK]
+    mic_signals *= amplitude / np.std(mic_signals)
+
+    # Inverse of the channel selection done in get_mic_data
+    data = np.zeros((CHUNK, CHANNELS), dtype=np.int16)
+    data[:, 1] = mic_signals[0]
+    data[:, -2:1:-1] = mic_signals[1:].T
+    return data
+
+
+def time_stage(func, inputs, repeats, warmup):
+    for i in range(warmup):
+        func(inputs[i % len(inputs)])
+
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start_time = time.perf_counter()
+        func(inputs[i % len(inputs)])
+        times[i] = time.perf_counter() - start_time
+
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000
+    return {
+        'n': repeats,
+        'mean_ms': round(np.mean(times) * 1000, 4),
+        'p50_ms': round(p50, 4),
+        'p95_ms': round(p95, 4),
+        'p99_ms': round(p99, 4),
+        'fps': round(1 / np.mean(times), 2),
+    }
+
+
+def invoke(interpreter, input_details, input_data):
+    interpreter.set_tensor(input_details['index'], input_data.astype(input_details['dtype']))
+    interpreter.invoke()
+
+
+def get_stages(n_inputs, tpu, rng):
+    """
+    Returns:
+        {stage: function returning (function to time, inputs)}, so only the selected
+        stages create their predictors and load their models
+    """
+    blocks = [synthetic_chunk(rng.uniform(0, 360), rng) for _ in range(n_inputs)]
+    in_data = [block.tobytes() for block in blocks]
+    mic_data = [get_mic_data(buffer)[1] for buffer in in_data]
+    input_data = [get_input_matrix(mic) for mic in mic_data]
+
+    @lru_cache(maxsize=None)
+    def single(parallel=False):
+        return SingleSourcePredictor(None, None, tpu=tpu, source=ReplaySource(blocks[0]), autostart=False,
+                                     parallel=parallel)
+
+    @lru_cache(maxsize=None)
+    def multi():
+        return MultiSourcePredictor(None, None, source=ReplaySource(blocks[0]), autostart=False)
+
+    def get_azimuth_inputs():
+        # Match the input layout get_azimuth_prediction gives the azimuth model
+        az_input_details = single().az_input_details
+        az_input_data = [data.reshape(az_input_details['shape']) for data in input_data]
+        if az_input_details['dtype'] == np.uint8:
+            input_scale, input_zero_point = az_input_details['quantization']
+            az_input_data = [data / input_scale + input_zero_point for data in az_input_data]
+        return az_input_data
+
+    return {
+        'get_mic_data': lambda: (get_mic_data, in_data),
+        'gcc_phat': lambda: (lambda mic: gcc_phat(mic[:, 0], mic[:, 1]), mic_data),
+        'compute_gcc_matrix': lambda: (compute_gcc_matrix, mic_data),
+        'get_input_matrix': lambda: (get_input_matrix, mic_data),
+        'azimuth_invoke': lambda: (lambda data: invoke(single().az_interpreter, single().az_input_details, data),
+                                   get_azimuth_inputs()),
+        'elevation_invoke': lambda: (lambda data: invoke(single().el_interpreter, single().el_input_details, data),
+                                     input_data),
+        'predict_frame': lambda: (single().predict_frame, mic_data),
+        'predict_frame_parallel': lambda: (single(parallel=True).predict_frame, mic_data),
+        'multi_source_invoke': lambda: (lambda data: invoke(multi().az_interpreter, multi().az_input_details, data),
+                                        input_data),
+        'compute_stft_matrix': lambda: (compute_stft_matrix, mic_data),
+        'get_music_prediction': lambda: (single().get_music_prediction,
+                                         [compute_stft_matrix(mic) for mic in mic_data]),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the DOA pipeline.')
+    parser.add_argument('--repeats', type=int, default=200, help='timed runs per stage')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed runs per stage')
+    parser.add_argument('--inputs', type=int, default=16, help='number of distinct synthetic chunks')
+    parser.add_argument('--stages', nargs='+', help='only run these stages')
+    parser.add_argument('--tpu', action='store_true', help='use the Edge TPU azimuth model')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    stages = get_stages(args.inputs, args.tpu, np.random.default_rng(args.seed))
+    results = {}
+    for name, create_stage in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        func, inputs = create_stage()
+        results[name] = time_stage(func, inputs, args.repeats, args.warmup)
+        print(f'{name:<22} p50 {results[name]["p50_ms"]:>9.3f} ms | p95 {results[name]["p95_ms"]:>9.3f} ms | '
+              f'p99 {results[name]["p99_ms"]:>9.3f} ms | {results[name]["fps"]:>9.1f} fps')
+
+    report = {
+        'meta': {
+            'commit': get_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'chunk': CHUNK,
+            'rate': RATE,
+            'tpu': args.tpu,
+            'repeats': args.repeats,
+        },
+        'stages': results,
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+"""
+Runs a predictor without the GUI and publishes its predictions as NDJSON.
+
+Usage: python3 daemon.py single|multi [--tpu] [--output stdout|console|unix:<path>|udp:<host>:<port>]
+                                      [--log predictions.csv|predictions.bin [--log-max-mb N]] [--all-events]
+                                      [--replay recording.wav ... [--fast]] [--device N ...] [--hop N]
+                                      [--track] [--decimate N] [--max-track-std DEGREES] [--parallel]
+                                      [--record recording.wav [--record-minutes N]] [--metrics-port N]
+                                      [--fft-backend auto|numpy|scipy[:N]|pyfftw[:N]] [--workers N]
+
+Several microphone arrays can be served at once by giving --device or --replay more than once.
+Their predictors are run by a pool of --workers inference threads, one per array up to the number
+of cores by default, and every event is tagged with the device index or replayed file it came
+from as 'source'. With a single worker, the arrays take turns and share the models.
+
+Events are written by a background thread in batches. Of consecutive events without a
+prediction, only the first is written unless --all-events is given.
+"""
+import argparse
+import os
+import signal
+import sys
+from contextlib import redirect_stdout
+from threading import Event
+
+from audio_source import PyAudioSource, ReplaySource
+from publishers import EventWriter, LogFilePublisher, create_publisher
+from scheduler import Scheduler
+from utils import CHUNK
+
+
+def create_predictor(mode, source, tpu=False, thresh=50, drop_policy='drop-oldest', hop=CHUNK, track=False,
+                     decimation=1, max_track_std=None, scheduler=None, source_id=None, parallel=False):
+    # Started by the caller once its listeners are attached
+    kwargs = dict(track=track, decimation=decimation, max_track_std=max_track_std, scheduler=scheduler,
+                  source_id=source_id, autostart=False)
+    # Imported here so only the models of the selected mode are loaded
+    if mode == 'single':
+        from single_source_predictor import SingleSourcePredictor
+        return SingleSourcePredictor(None, None, thresh=thresh, tpu=tpu, source=source, active=True,
+                                     drop_policy=drop_policy, verbose=False, hop=hop, parallel=parallel, **kwargs)
+    else:
+        from multi_source_predictor import MultiSourcePredictor
+        return MultiSourcePredictor(None, None, thresh=thresh, source=source, active=True,
+                                    drop_policy=drop_policy, verbose=False, hop=hop, **kwargs)
+
+
+def get_record_path(path, source_index, n_sources):
+    # Every array is recorded to its own file, numbered in the order the sources were given
+    if n_sources == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}_source{source_index}{ext}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless DOA estimation streaming predictions as NDJSON.')
+    parser.add_argument('mode', choices=['single', 'multi'])
+    parser.add_argument('--tpu', action='store_true', help='use the Edge TPU azimuth model (single mode)')
+    parser.add_argument('--output', default='stdout',
+                        help='stdout, console, unix:<socket path> or udp:<host>:<port>')
+    parser.add_argument('--log',
+                        help='also log the predictions to a rotating CSV file, or binary unless it ends in .csv')
+    parser.add_argument('--log-max-mb', type=float, default=100, help='start a new log file after this many megabytes')
+    parser.add_argument('--all-events', action='store_true',
+                        help='write every event, including repeated ones without a prediction')
+    parser.add_argument('--thresh', type=int, default=50, help='activity threshold')
+    parser.add_argument('--hop', type=int, default=CHUNK,
+                        help=f'samples between predictions, must divide {CHUNK}')
+    parser.add_argument('--device', type=int, action='append', default=[],
+                        help='PortAudio input device index, repeat to capture several arrays')
+    parser.add_argument('--replay', action='append', default=[],
+                        help='replay a recorded WAV file instead of capturing live audio, repeat to replay several')
+    parser.add_argument('--fast', action='store_true', help='replay as fast as possible instead of in real time')
+    parser.add_argument('--record', help='also record the input to this WAV file, rotated every --record-minutes')
+    parser.add_argument('--record-minutes', type=float, help='start a new recording file after this many minutes')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on http://127.0.0.1:<port>/metrics')
+    parser.add_argument('--track', action='store_true', help='smooth predictions with a tracker')
+    parser.add_argument('--decimate', type=int, default=1,
+                        help='run the networks on every N-th active frame only and extrapolate the tracks in between')
+    parser.add_argument('--max-track-std', type=float,
+                        help='also run the networks when the tracked azimuth is more uncertain than this (degrees)')
+    parser.add_argument('--workers', type=int,
+                        help='inference threads shared by several arrays, one per array up to the number of cores '
+                             'by default')
+    parser.add_argument('--parallel', action='store_true',
+                        help='run the azimuth and elevation models of a frame at the same time (single mode)')
+    parser.add_argument('--fft-backend',
+                        help='FFT library and threads: auto, numpy, scipy[:N] or pyfftw[:N], '
+                             'DOA_FFT_BACKEND or the fastest by default')
+    args = parser.parse_args()
+
+    if args.fft_backend:
+        import fft_backend
+        fft_backend.set_backend(args.fft_backend, CHUNK)
+
+    sources = {}
+    for path in args.replay:
+        sources[path] = ReplaySource.from_wav(path, realtime=not args.fast)
+    for device in args.device:
+        sources[device] = PyAudioSource(device)
+    if not sources:
+        sources[None] = PyAudioSource()
+
+    # Replaying faster than real time must not lose frames, so wait for the worker instead
+    drop_policy = 'block' if args.replay and args.fast else 'drop-oldest'
+
+    publishers = [create_publisher(args.output)]
+    if args.log:
+        # Binary logs number the arrays in the order they were given
+        publishers.append(LogFilePublisher(args.log, int(args.log_max_mb * 1e6), sources=list(sources)))
+    writer = EventWriter(publishers, coalesce=not args.all_events, drop_policy=drop_policy)
+
+    # Several arrays share a pool of inference workers, a single one keeps its own and its events untagged
+    workers = args.workers or min(len(sources), os.cpu_count() or 1)
+    scheduler = Scheduler(workers) if len(sources) > 1 else None
+
+    # Model loading messages would corrupt the NDJSON stream on stdout
+    predictors = []
+    with redirect_stdout(sys.stderr):
+        for source_id, source in sources.items():
+            predictors.append(create_predictor(args.mode, source, args.tpu, args.thresh, drop_policy, args.hop,
+                                               args.track, args.decimate, args.max_track_std, scheduler,
+                                               source_id if scheduler is not None else None, args.parallel))
+    for predictor in predictors:
+        predictor.add_listener(writer.publish)
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        from metrics import serve
+        metrics_server = serve(port=args.metrics_port)
+
+    recorders = []
+    if args.record:
+        from recorder import Recorder
+        max_seconds = args.record_minutes * 60 if args.record_minutes else None
+        for i, predictor in enumerate(predictors):
+            recorder = Recorder(get_record_path(args.record, i, len(predictors)), max_seconds=max_seconds)
+            predictor.add_tap(recorder.put)
+            recorders.append(recorder)
+
+    # Everything is attached before the streams start, so no event or recorded block is lost
+    for predictor in predictors:
+        predictor.start()
+
+    stopped = Event()
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+
+    while not stopped.wait(0.5):
+        if writer.failed:
+            break
+        # Live devices keep the daemon running, replays alone end it once they are all done
+        if not args.device and args.replay and not any(source.is_active() for source in sources.values()):
+            for predictor in predictors:
+                predictor.join()
+            break
+
+    for predictor in predictors:
+        predictor.close()
+    if scheduler is not None:
+        scheduler.close()
+    writer.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    for recorder in recorders:
+        recorder.close()
+
+
+if __name__ == '__main__':
+    main()
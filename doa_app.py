@@ -1,17 +1,58 @@
 import math
 from tkinter import *
 import platform
+import time
 from tkinter import messagebox
 
-import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
 from multi_source_predictor import MultiSourcePredictor
 from single_source_predictor import SingleSourcePredictor
 from utils import UI_RESOLUTION, CHUNK
 
 
+class WheelRenderer:
+    """
+    Draws per-sector confidences on the DOA wheel. Arc items are created once,
+    afterwards only the coordinates and colours of sectors whose value changed are updated.
+    """
+    BEST_COLORS = '#78ebb3', '#2ca86b'
+    OTHER_COLORS = '#ffadad', '#db6b6b'
+
+    def __init__(self, canvas, dim, radius):
+        self.canvas = canvas
+        self.center = dim / 2
+        self.radius = radius
+
+        c = self.center
+        self.arcs = [canvas.create_arc(c, c, c, c, start=i - UI_RESOLUTION // 2, extent=UI_RESOLUTION,
+                                       width=2, state=HIDDEN)
+                     for i in range(0, 360, UI_RESOLUTION)]
+        self.drawn = [None] * len(self.arcs)
+
+    def draw(self, confs, best):
+        """
+        Args:
+            confs: confidence of every sector, None for sectors that should not be drawn
+            best: a function telling whether the sector with a given index is a predicted direction
+        """
+        for i, conf in enumerate(confs):
+            # Colour the fraction of arc area proportional to probability,
+            # rounded to whole pixels so tiny changes do not trigger a redraw
+            state = None if conf is None else (round(self.radius * conf ** 0.5), best(i))
+            if state == self.drawn[i]:
+                continue
+            self.drawn[i] = state
+
+            arc = self.arcs[i]
+            if state is None:
+                self.canvas.itemconfig(arc, state=HIDDEN)
+                continue
+
+            R, is_best = state
+            fill, outline = self.BEST_COLORS if is_best else self.OTHER_COLORS
+            self.canvas.coords(arc, self.center - R, self.center - R, self.center + R, self.center + R)
+            self.canvas.itemconfig(arc, fill=fill, outline=outline, state=NORMAL)
+
+
 class DoaApp:
     # Window size
     WIDTH = 1000
@@ -29,10 +70,19 @@ class DoaApp:
     # Radius of the circle
     RADIUS = DIM / 2 - DIST
 
-    def __init__(self, top, tpu=False):
-        self.fig, self.axs = plt.subplots(3, 2, figsize=(6, 6))
+    # Maximum GUI refresh rate
+    MAX_FPS = 30
+
+    def __init__(self, top, tpu=False, max_fps=MAX_FPS):
+        # The signal plot is only shown on Windows, matplotlib is not loaded otherwise
+        self.fig = None
         self.lines = []
         self.tpu = tpu
+        self.frame_interval = max(1, round(1000 / max_fps))
+
+        self.predictor = None
+        self.renderer = None
+        self.after_id = None
 
         self.prediction_running = False
         self.top = top
@@ -52,6 +102,53 @@ class DoaApp:
             self.window = Toplevel(self.top)
             self.open_plot()
 
+    def run(self):
+        C = self.create_canvas()
+        self.renderer = WheelRenderer(C, self.DIM, self.RADIUS)
+
+        self.predictor = self.create_widgets()
+        if not self.predictor:
+            return
+
+        # Canvas is destroyed when the window is closed or the mode is changed
+        C.bind('<Destroy>', lambda event: self.close())
+        self.refresh()
+
+    def create_widgets(self):
+        """
+        Creates the mode specific widgets and returns the predictor.
+        """
+        raise NotImplementedError
+
+    def update_view(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        start_time = time.perf_counter()
+        try:
+            self.update_view()
+        except TclError:
+            self.close()
+            return
+        self.predictor.observe('render', time.perf_counter() - start_time)
+        self.after_id = self.top.after(self.frame_interval, self.refresh)
+
+    def close(self):
+        if self.predictor is None:
+            return
+
+        if self.after_id is not None:
+            try:
+                self.top.after_cancel(self.after_id)
+            except TclError:
+                pass
+        self.predictor.close()
+        self.on_close(self.predictor)
+        self.predictor = None
+
+    def on_close(self, predictor):
+        pass
+
     def select_mode(self):
         self.data_frame.destroy()
         self.circle_frame.destroy()
@@ -126,8 +223,15 @@ class DoaApp:
                                  "Input audio device does not have 8 channels. "
                                  "Please connect the MiniDSP board and start the application again.")
             self.top.destroy()
+        except ValueError as e:
+            messagebox.showerror("Missing model", str(e))
+            self.top.destroy()
 
     def open_plot(self):
+        from matplotlib import pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.fig, axs = plt.subplots(3, 2, figsize=(6, 6))
         self.window.title('Real-time signals plot')
 
         x = self.top.winfo_rootx()
@@ -138,13 +242,12 @@ class DoaApp:
         self.fig.suptitle('Microphone array data')
         plt.subplots_adjust(hspace=0.8, wspace=0.5)
 
-        for i, ax in enumerate(self.axs.flat):
+        for i, ax in enumerate(axs.flat):
             ax.set_title(f'Microphone {i + 1}: {i * 60}\N{DEGREE SIGN}')
             ax.set_ylim(-300, 300)
             ax.set_xlim(0, CHUNK)
 
-            x = np.arange(0, 2 * CHUNK, 2)
-            self.lines += ax.plot(x, np.random.rand(CHUNK))
+            self.lines += ax.plot([], [])
 
         canvas = FigureCanvasTkAgg(self.fig, master=self.window)
         canvas.draw()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+"""
+Compares the accuracy and latency of the DOA estimators on labelled recordings, named
+recording_angle_<azimuth>.wav as written by record.py. Every estimator runs frame by frame
+on every frame loud enough to be processed by the apps, with files spread over all CPU cores.
+
+Estimators: cnn (azimuth CNN), music (MUSIC), elevation (elevation CNN) and multi (multi-source
+CNN, its most confident sector). Elevation errors need the elevation the recordings were made at.
+
+Usage: python3 evaluate.py <directory or WAV files...> [--estimators cnn music elevation multi]
+                           [--tolerance 5 10 20] [--elevation DEG] [--thresh N] [--hop N]
+                           [--workers N] [--threads N] [--tpu] [--output evaluation.json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from audio_source import ReplaySource, read_wav
+from offline import find_recordings
+from predictor import get_mic_data
+from tracker import wrap_angle
+from utils import *
+
+ESTIMATORS = ['cnn', 'music', 'elevation', 'multi']
+
+# Parts of rotated recordings have their number appended, recording_angle_90_001.wav
+LABEL_PATTERN = re.compile(r'recording_angle_(-?\d+(?:\.\d+)?)(?:_\d+)?\.wav$')
+
+# Estimator functions of the worker process, each taking a frame and returning an angle
+worker_estimators = None
+
+
+def init_worker(estimators, tpu, num_threads):
+    global worker_estimators
+
+    # An empty replay source, evaluation workers never open an audio stream
+    source = ReplaySource(np.zeros((0, CHANNELS), dtype=np.int16))
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if {'cnn', 'music', 'elevation'} & set(estimators):
+            from single_source_predictor import SingleSourcePredictor
+            single = SingleSourcePredictor(None, None, tpu=tpu, source=source, autostart=False,
+                                           verbose=False, num_threads=num_threads)
+        if 'multi' in estimators:
+            from multi_source_predictor import MultiSourcePredictor
+            multi = MultiSourcePredictor(None, None, source=source, autostart=False,
+                                         verbose=False, num_threads=num_threads)
+
+    def cnn(mic_data):
+        single.write_model_inputs(mic_data)
+        return single.get_azimuth_prediction()[0]
+
+    def music(mic_data):
+        return single.run_music(mic_data)[0]
+
+    def elevation(mic_data):
+        single.write_model_inputs(mic_data)
+        return single.get_elevation_prediction()[0]
+
+    def most_confident_source(mic_data):
+        return np.argmax(multi.predict_frame(mic_data)) * UI_RESOLUTION
+
+    functions = {'cnn': cnn, 'music': music, 'elevation': elevation, 'multi': most_confident_source}
+    worker_estimators = {name: functions[name] for name in estimators}
+
+    # First calls pay for lazy imports and allocations, keep them out of the latencies
+    noise = np.random.default_rng(0).normal(0, 100, (CHUNK, CHANNELS - 2)).astype(np.int16)
+    for estimator in worker_estimators.values():
+        estimator(noise)
+
+
+def get_label(path):
+    match = LABEL_PATTERN.search(os.path.basename(path))
+    return float(match.group(1)) if match else None
+
+
+def evaluate_file(path, hop, thresh):
+    """
+    Runs every estimator of the worker on the frames of a file whose peak magnitude exceeds thresh.
+
+    Returns:
+        Predictions and latencies in seconds of every estimator, one per frame
+    """
+    _, mic_data = get_mic_data(read_wav(path).tobytes())
+    results = {name: ([], []) for name in worker_estimators}
+
+    for start in range(0, len(mic_data) - CHUNK + 1, hop):
+        frame = mic_data[start:start + CHUNK]
+        if max(frame.max(), -frame.min()) <= thresh:
+            continue
+        for name, estimator in worker_estimators.items():
+            start_time = time.perf_counter()
+            prediction = estimator(frame)
+            latency = time.perf_counter() - start_time
+            results[name][0].append(prediction)
+            results[name][1].append(latency)
+
+    return {name: (np.array(predictions, dtype=float), np.array(latencies))
+            for name, (predictions, latencies) in results.items()}
+
+
+def get_metrics(errors, latencies, tolerances):
+    """
+    Returns:
+        Circular MAE, accuracy within every tolerance, latency statistics and accuracy per millisecond
+    """
+    metrics = {'frames': len(latencies)}
+    if not len(latencies):
+        return metrics
+
+    mean_latency = np.mean(latencies) * 1000
+    metrics.update(latency_mean_ms=round(mean_latency, 3),
+                   latency_p95_ms=round(np.percentile(latencies, 95) * 1000, 3))
+    if errors is not None:
+        metrics['mae'] = round(np.mean(errors), 2)
+        for tolerance in tolerances:
+            metrics[f'accuracy_{tolerance:g}'] = round(np.mean(errors <= tolerance), 4)
+        # Accuracy at the first tolerance for every millisecond spent per frame
+        metrics['accuracy_per_ms'] = round(metrics[f'accuracy_{tolerances[0]:g}'] / mean_latency, 4)
+    return metrics
+
+
+def print_report(report, tolerances):
+    columns = ['frames', 'mae'] + [f'accuracy_{tolerance:g}' for tolerance in tolerances] + \
+              ['latency_mean_ms', 'latency_p95_ms', 'accuracy_per_ms']
+    headers = ['frames', 'MAE'] + [f'±{tolerance:g}°' for tolerance in tolerances] + \
+              ['mean ms', 'p95 ms', 'acc/ms']
+
+    print('{:<10}'.format('estimator') + ''.join('{:>10}'.format(header) for header in headers))
+    for name, metrics in report.items():
+        print('{:<10}'.format(name) + ''.join('{:>10}'.format(metrics.get(column, '-')) for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accuracy and latency of the DOA estimators on labelled recordings.')
+    parser.add_argument('paths', nargs='+', help='recording_angle_<azimuth>.wav files or directories containing them')
+    parser.add_argument('--estimators', nargs='+', choices=ESTIMATORS, default=ESTIMATORS)
+    parser.add_argument('--tolerance', type=float, nargs='+', default=[5, 10, 20],
+                        help='report the fraction of frames within these errors in degrees')
+    parser.add_argument('--elevation', type=float, help='elevation all recordings were made at, in degrees')
+    parser.add_argument('--thresh', type=int, default=50, help='skip frames with a lower peak magnitude')
+    parser.add_argument('--hop', type=int, default=CHUNK, help='samples between consecutive frames')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes, more than the number of cores skews latencies')
+    parser.add_argument('--threads', type=int, default=1, help='TFLite threads per interpreter')
+    parser.add_argument('--tpu', action='store_true', help='use the Edge TPU azimuth model')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    args = parser.parse_args()
+
+    recordings = [path for path in find_recordings(args.paths) if get_label(path) is not None]
+    if not recordings:
+        sys.exit('No labelled recordings found.')
+
+    errors = {name: [] for name in args.estimators}
+    latencies = {name: [] for name in args.estimators}
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.estimators, args.tpu, args.threads)) as executor:
+        n = len(recordings)
+        for path, results in zip(recordings, executor.map(evaluate_file, recordings, [args.hop] * n,
+                                                          [args.thresh] * n)):
+            for name, (predictions, file_latencies) in results.items():
+                if name != 'elevation':
+                    errors[name].append(np.abs(wrap_angle(predictions - get_label(path))))
+                elif args.elevation is not None:
+                    errors[name].append(np.abs(predictions - args.elevation))
+                latencies[name].append(file_latencies)
+
+    report = {name: get_metrics(np.concatenate(errors[name]) if errors[name] else None,
+                                np.concatenate(latencies[name]), args.tolerance)
+              for name in args.estimators}
+
+    print(f'Evaluated {len(recordings)} recordings.\n')
+    print_report(report, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nReport written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from functools import lru_cache
+
+from numpy.lib.format import open_memmap
+
+from audio_source import open_wav, to_device_layout
+from predictor import get_mic_data
+from utils import *
+
+CACHE_DIR = '.feature_cache'
+
+# Bump when the way features are computed changes, to invalidate existing caches
+FORMAT_VERSION = 1
+
+
+@lru_cache(maxsize=256)
+def hash_file(path, mtime_ns, size):
+    """
+    SHA-256 of a file, remembered for as long as its modification time and size stay the same.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_file_hash(path):
+    stat = os.stat(path)
+    return hash_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def get_params(kind, hop=CHUNK, interp=1, nfft=256):
+    """
+    Parameters the features of a given kind depend on.
+    """
+    params = {'kind': kind, 'version': FORMAT_VERSION, 'chunk': CHUNK, 'rate': RATE, 'hop': hop}
+    if kind == 'gcc':
+        params.update(interp=interp, max_len=gcc_max_len(interp))
+    elif kind == 'stft':
+        params.update(nfft=nfft)
+    else:
+        raise ValueError(f'Unknown feature kind {kind!r}, expected gcc or stft')
+    return params
+
+
+def get_key(file_hash, params):
+    """
+    Name of the cache entry of a file, which changes with its contents or any of the parameters.
+    """
+    return hashlib.sha256(json.dumps([file_hash, params], sort_keys=True).encode()).hexdigest()[:32]
+
+
+def build_features(path, file_hash, params, entry_dir):
+    """
+    Computes the features of every frame of a recording and writes them to entry_dir.
+    Frames are read from the memory-mapped recording and written one by one to a memory-mapped file,
+    so neither the audio nor the features ever have to fit in memory.
+    """
+    recording = open_wav(path)
+    starts = range(0, len(recording) - CHUNK + 1, params['hop'])
+
+    if params['kind'] == 'gcc':
+        shape, dtype = (2 * params['max_len'] + 1, len(MIC_PAIRS)), np.float32
+        workspace = GccWorkspace(gcc_fft_len(CHUNK), params['interp'])
+    else:
+        shape, dtype = compute_stft_matrix(np.zeros((CHUNK, CHANNELS - 2)), params['nfft']).shape, np.complex64
+
+    tmp_dir = f'{entry_dir}.tmp{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    features = open_memmap(os.path.join(tmp_dir, 'features.npy'), mode='w+', dtype=dtype,
+                           shape=(len(starts), *shape))
+    for start, out in zip(starts, features):
+        _, frame = get_mic_data(to_device_layout(recording[start:start + CHUNK]).tobytes())
+        if params['kind'] == 'gcc':
+            # Stored transposed, the layout the models take
+            compute_gcc_matrix(frame, params['interp'], out=out.T, workspace=workspace)
+        else:
+            out[:] = compute_stft_matrix(frame, params['nfft'])
+    features.flush()
+    del features
+
+    meta = {'source': os.path.abspath(path), 'hash': file_hash, 'params': params, 'frames': len(starts),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    # Entries only appear once complete, a concurrent build of the same entry is simply discarded
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def remove_stale_entries(path, file_hash, cache_dir):
+    """
+    Removes the entries of a recording that were computed from an older version of it
+    or by an older version of this module. Entries with other parameters are kept.
+    """
+    source = os.path.abspath(path)
+    for name in os.listdir(cache_dir):
+        meta_path = os.path.join(cache_dir, name, 'meta.json')
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['source'] == source and (meta['hash'] != file_hash or meta['params']['version'] != FORMAT_VERSION):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def load_features(path, kind='gcc', hop=CHUNK, interp=1, nfft=256, cache_dir=CACHE_DIR):
+    """
+    Returns the features of every frame of a recording as a read-only memory-mapped array,
+    computing and caching them first if needed. GCC features have shape
+    (frames, 2 * max_len + 1, 15), STFT features (frames, 6, nfft // 2 + 1, STFT frames).
+    """
+    params = get_params(kind, hop, interp, nfft)
+    file_hash = get_file_hash(path)
+    entry_dir = os.path.join(cache_dir, get_key(file_hash, params))
+
+    if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+        os.makedirs(cache_dir, exist_ok=True)
+        remove_stale_entries(path, file_hash, cache_dir)
+        build_features(path, file_hash, params, entry_dir)
+
+    return np.load(os.path.join(entry_dir, 'features.npy'), mmap_mode='r')
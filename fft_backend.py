@@ -0,0 +1,200 @@
+import os
+import pickle
+import time
+from threading import Lock, RLock
+
+import numpy as np
+import scipy.fft as sp_fft
+
+# FFTW plans measured on this machine, so later runs skip the planning
+WISDOM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.fftw_wisdom')
+
+
+def next_fast_len(n):
+    """
+    Smallest length of at least n with only the factors 2, 3 and 5, which every backend transforms fast.
+    """
+    return sp_fft.next_fast_len(n, real=True)
+
+
+class NumpyBackend:
+    """
+    numpy.fft, single threaded. Single precision input gives single precision output, as with the other backends.
+    """
+    name = 'numpy'
+
+    def rfft(self, x, n, axis=-1):
+        X = np.fft.rfft(x, n=n, axis=axis)
+        return X.astype(np.complex64) if x.dtype == np.float32 else X
+
+    def irfft(self, X, n, axis=-1, overwrite_x=False):
+        x = np.fft.irfft(X, n=n, axis=axis)
+        return x.astype(np.float32) if X.dtype == np.complex64 else x
+
+
+class ScipyBackend:
+    """
+    scipy.fft, splitting transforms of several channels over workers threads.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.name = f'scipy:{workers}'
+
+    def rfft(self, x, n, axis=-1):
+        return sp_fft.rfft(x, n=n, axis=axis, workers=self.workers)
+
+    def irfft(self, X, n, axis=-1, overwrite_x=False):
+        return sp_fft.irfft(X, n=n, axis=axis, overwrite_x=overwrite_x, workers=self.workers)
+
+
+class FftwBackend:
+    """
+    pyFFTW with one plan per transform shape, made on first use and kept for the lifetime of the backend.
+    Plans are measured rather than estimated, the wisdom gathered is saved to wisdom_file
+    and loaded again by the next process.
+    """
+
+    def __init__(self, threads=1, planner_effort='FFTW_MEASURE', wisdom_file=WISDOM_FILE):
+        # Optional dependency, raises ImportError if it is not installed
+        import pyfftw
+
+        self.builders = pyfftw.builders
+        self.pyfftw = pyfftw
+        self.threads = threads
+        self.planner_effort = planner_effort
+        self.wisdom_file = wisdom_file
+        self.name = f'pyfftw:{threads}'
+
+        self.plans = {}
+        self.lock = Lock()
+        if wisdom_file is not None:
+            self.load_wisdom()
+
+    def load_wisdom(self):
+        try:
+            with open(self.wisdom_file, 'rb') as f:
+                self.pyfftw.import_wisdom(pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError):
+            # Missing or damaged wisdom only costs planning time, plans are made from scratch
+            pass
+
+    def save_wisdom(self):
+        # Other processes may be loading the file, so it is replaced in one step, never rewritten in place
+        tmp_file = f'{self.wisdom_file}.tmp{os.getpid()}'
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(self.pyfftw.export_wisdom(), f)
+            os.replace(tmp_file, self.wisdom_file)
+        except OSError:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def get_plan(self, builder, x, n, axis):
+        key = builder.__name__, x.shape, x.dtype.str, n, axis
+        if key not in self.plans:
+            # Measuring overwrites the array planned on, so plan on a scratch one
+            self.plans[key] = builder(np.zeros(x.shape, dtype=x.dtype), n=n, axis=axis, threads=self.threads,
+                                      planner_effort=self.planner_effort)
+            if self.wisdom_file is not None:
+                self.save_wisdom()
+        return self.plans[key]
+
+    def transform(self, builder, x, n, axis):
+        # A plan transforms in its own buffers, which the result is copied out of
+        with self.lock:
+            return self.get_plan(builder, x, n, axis)(x).copy()
+
+    def rfft(self, x, n, axis=-1):
+        return self.transform(self.builders.rfft, x, n, axis)
+
+    def irfft(self, X, n, axis=-1, overwrite_x=False):
+        return self.transform(self.builders.irfft, X, n, axis)
+
+
+def create_backend(name):
+    """
+    Creates a backend from its name: numpy, scipy[:workers] or pyfftw[:threads].
+    """
+    kind, _, threads = name.partition(':')
+    threads = int(threads) if threads else 1
+    if kind == 'numpy':
+        return NumpyBackend()
+    elif kind == 'scipy':
+        return ScipyBackend(threads)
+    elif kind == 'pyfftw':
+        return FftwBackend(threads)
+    raise ValueError(f'Unknown FFT backend {name!r}, expected auto, numpy, scipy[:workers] or pyfftw[:threads]')
+
+
+def available_backends():
+    """
+    Names of the backends that can be used here, single and multi-threaded where that makes a difference.
+    """
+    names = ['numpy', 'scipy:1']
+    cores = os.cpu_count() or 1
+    if cores > 1:
+        names.append(f'scipy:{cores}')
+    try:
+        import pyfftw
+        names.append('pyfftw:1')
+        if cores > 1:
+            names.append(f'pyfftw:{cores}')
+    except ImportError:
+        pass
+    return names
+
+
+def benchmark(backend, n_samples=4096, channels=6, pairs=15, repeats=20):
+    """
+    Time of the transforms of one GCC matrix in seconds, the best of repeats runs:
+    the forward transform of all channels and the inverse transform of all pairs.
+    """
+    n = next_fast_len(2 * n_samples - 1)
+    x = np.random.default_rng(0).standard_normal((n_samples, channels)).astype(np.float32)
+    X = backend.rfft(np.zeros((n_samples, pairs), dtype=np.float32), n, axis=0).T.copy()
+
+    times = []
+    for _ in range(repeats + 1):
+        start_time = time.perf_counter()
+        backend.rfft(x, n, axis=0)
+        backend.irfft(X, n, axis=1)
+        times.append(time.perf_counter() - start_time)
+    # The first run plans and warms up
+    return min(times[1:])
+
+
+def select_fastest(n_samples=4096):
+    """
+    Benchmarks every available backend on frames of n_samples and returns the fastest.
+    """
+    backends = [create_backend(name) for name in available_backends()]
+    return min(backends, key=lambda backend: benchmark(backend, n_samples))
+
+
+# Backend of the process, chosen on first use, and the lock that makes sure it is only chosen once
+backend = None
+backend_lock = RLock()
+
+
+def set_backend(name='auto', n_samples=4096):
+    """
+    Selects the backend used for all transforms, the fastest one on frames of n_samples with 'auto'.
+    """
+    global backend
+    with backend_lock:
+        backend = select_fastest(n_samples) if name == 'auto' else create_backend(name)
+        return backend
+
+
+def get_backend(n_samples=4096):
+    """
+    The backend of the process. Unless set_backend was called, the DOA_FFT_BACKEND environment
+    variable selects it, the fastest one on frames of n_samples is chosen if that is not set either.
+    Choosing the fastest takes a while, so the predictors get the backend when they are created.
+    """
+    if backend is None:
+        with backend_lock:
+            if backend is None:
+                set_backend(os.environ.get('DOA_FFT_BACKEND', 'auto'), n_samples)
+    return backend
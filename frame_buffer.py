@@ -0,0 +1,98 @@
+from collections import deque
+from threading import Condition
+
+
+class FrameBuffer:
+    """
+    Bounded ring buffer handing raw audio blocks from the capture callback to the inference worker.
+
+    When the buffer is full, 'drop-oldest' discards the oldest queued block, 'drop-newest'
+    discards the incoming one and 'block' makes put wait for space. 'block' is only meant for
+    replayed audio, a live capture callback must never wait.
+    """
+    POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+    def __init__(self, size=4, policy='drop-oldest'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown drop policy {policy!r}, expected one of {self.POLICIES}')
+        if size < 1:
+            raise ValueError('Frame buffer size must be at least 1')
+
+        self.size = size
+        self.policy = policy
+        self.frames = deque()
+        self.condition = Condition()
+        self.closed = False
+
+        # Frames queued or being processed, used by join
+        self.unfinished = 0
+        self.dropped_frames = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame):
+        """
+        Queues a frame. Returns False if the frame was dropped.
+        """
+        with self.condition:
+            if self.closed:
+                return False
+
+            if len(self.frames) >= self.size:
+                if self.policy == 'drop-newest':
+                    self.dropped_frames += 1
+                    return False
+                elif self.policy == 'drop-oldest':
+                    self.frames.popleft()
+                    self.unfinished -= 1
+                    self.dropped_frames += 1
+                else:
+                    self.condition.wait_for(lambda: len(self.frames) < self.size or self.closed)
+                    if self.closed:
+                        return False
+
+            self.frames.append(frame)
+            self.unfinished += 1
+            self.condition.notify_all()
+            return True
+
+    def get(self):
+        """
+        Waits for the next frame. Returns None once the buffer has been closed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed)
+            if self.closed:
+                return None
+
+            frame = self.frames.popleft()
+            self.condition.notify_all()
+            return frame
+
+    def get_pending(self, max_frames):
+        """
+        Takes up to max_frames frames that are already queued, without waiting.
+        """
+        with self.condition:
+            frames = [self.frames.popleft() for _ in range(min(max_frames, len(self.frames)))]
+            self.condition.notify_all()
+            return frames
+
+    def task_done(self, count=1):
+        with self.condition:
+            self.unfinished -= count
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued frame has been processed.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.unfinished <= 0 or self.closed, timeout)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify_all()
@@ -0,0 +1,113 @@
+from collections import deque
+
+from utils import *
+
+
+class ActivityGate:
+    """
+    Decides for every frame whether the models should run, so silence and steady background
+    noise do not cost any inference.
+
+    A frame is active when its peak magnitude exceeds thresh and its RMS stands snr_db above
+    the noise floor. The floor is the lowest frame RMS of the last noise_window frames, including
+    the current one (minimum statistics). Steady noise therefore becomes part of the background
+    as soon as it is there, at startup or after a step in level once the quieter frames have left
+    the window, about 19 s with the default hop. Speech and other sounds with pauses keep the floor
+    down and stay detected, a sound that goes on without any pause for longer than the window
+    is taken for background. With max_flatness set, frames whose averaged power spectrum is flatter
+    than that (broadband noise) are rejected as well, using the spectra the GCC computation reuses
+    afterwards.
+
+    The gate opens after attack_frames consecutive active frames and closes after release_frames
+    consecutive inactive ones. While open, the models run on active frames and the last
+    prediction is held through inactive ones. Once closed, predictions are cleared.
+
+    Any object with update(mic_data), is_open, spectra and skipped_frames can be used instead.
+    """
+
+    def __init__(self, thresh=50, snr_db=6.0, attack_frames=1, release_frames=10, noise_window=200,
+                 max_flatness=None, flatness_band=(300.0, 4000.0)):
+        self.thresh = thresh
+        self.snr = 10 ** (snr_db / 20)
+        self.attack_frames = attack_frames
+        self.release_frames = release_frames
+        self.noise_window = noise_window
+        self.max_flatness = max_flatness
+
+        self.n = gcc_fft_len(CHUNK)
+        self.band = slice(*(round(f * self.n / RATE) for f in flatness_band))
+
+        # (frame, RMS) of the frames in the window with increasing RMS, the first one is the minimum
+        self.noise_candidates = deque()
+        self.noise_floor = 0.0
+        self.active_frames = 0
+        self.inactive_frames = release_frames
+        self.is_open = False
+
+        # Spectra of the last frame, if the flatness test computed them
+        self.spectra = None
+
+        self.frames = 0
+        self.skipped_frames = 0
+
+    def get_features(self, mic_data):
+        """
+        Returns:
+            Peak magnitude and RMS of a frame over all microphones
+        """
+        peak = max(mic_data.max(), -mic_data.min())
+        rms = math.sqrt(np.vdot(mic_data, mic_data) / mic_data.size)
+        return peak, rms
+
+    def spectral_flatness(self, spectra):
+        """
+        Ratio of the geometric to the arithmetic mean of the power spectrum averaged over the microphones,
+        close to 1 for white noise and close to 0 for tonal sounds.
+        """
+        power = np.mean(np.abs(spectra[:, self.band]) ** 2, axis=0) + 1e-12
+        return math.exp(np.mean(np.log(power))) / np.mean(power)
+
+    def update_noise_floor(self, rms):
+        # Sliding window minimum, frames louder than a later one can never be the minimum again
+        candidates = self.noise_candidates
+        while candidates and candidates[-1][1] >= rms:
+            candidates.pop()
+        candidates.append((self.frames, rms))
+        if candidates[0][0] <= self.frames - self.noise_window:
+            candidates.popleft()
+        self.noise_floor = candidates[0][1]
+
+    def is_active(self, mic_data):
+        self.spectra = None
+        peak, rms = self.get_features(mic_data)
+        self.update_noise_floor(rms)
+
+        active = peak > self.thresh and rms > self.noise_floor * self.snr
+        if active and self.max_flatness is not None:
+            self.spectra = compute_spectra(mic_data, self.n)
+            active = self.spectral_flatness(self.spectra) <= self.max_flatness
+        return active
+
+    def update(self, mic_data):
+        """
+        Processes the next frame.
+
+        Returns:
+            True if the models should run on this frame
+        """
+        active = self.is_active(mic_data)
+        if active:
+            self.active_frames += 1
+            self.inactive_frames = 0
+            if self.active_frames >= self.attack_frames:
+                self.is_open = True
+        else:
+            self.active_frames = 0
+            self.inactive_frames += 1
+            if self.inactive_frames >= self.release_frames:
+                self.is_open = False
+
+        run = active and self.is_open
+        self.frames += 1
+        self.skipped_frames += not run
+        return run
@@ -1,8 +1,14 @@
+import sys
+
 import pyaudio
 import numpy as np
 import matplotlib.pyplot as plt
+from signal_plot import SignalPlot
 from utils import CHUNK, RATE, CHANNELS, FORMAT
 
+# Maximum redraws per second, the first argument if given
+MAX_FPS = float(sys.argv[1]) if len(sys.argv) > 1 else 15
+
 p = pyaudio.PyAudio()
 stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
 
@@ -18,8 +24,10 @@ for i, ax in enumerate(axs.flat):
     ax.set_ylim(-300, 300)
     ax.set_xlim(0, CHUNK)
 
-    x = np.arange(0, 2 * CHUNK, 2)
-    lines += ax.plot(x, np.random.rand(CHUNK))
+    lines += ax.plot([], [])
+
+plt.show(block=False)
+plot = SignalPlot(fig, lines, MAX_FPS)
 
 i = 1
 # Read signals forever
@@ -28,13 +36,9 @@ while True:
         data = np.frombuffer(stream.read(CHUNK), dtype=np.int16)
 
         # Update plots with data from the new frame
-        for c in range(CHANNELS - 2):
-            mic_data = data[c::CHANNELS]
-            lines[c].set_ydata(mic_data)
-
-        fig.canvas.draw()
-        fig.canvas.flush_events()
-        plt.pause(0.005)
+        plot.update(data.reshape(-1, CHANNELS)[:, :CHANNELS - 2])
+        if not plot.draw():
+            fig.canvas.flush_events()
 
         # Print out the first reading of each microphone from the new frame
         frmt = "{:>5}" * (CHANNELS - 1)
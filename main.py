@@ -1,8 +1,46 @@
+import builtins
 import sys
+import time
+from threading import main_thread, current_thread
 from tkinter import *
 
-from multi_source_app import MultiSourceApp
-from single_source_app import SingleSourceApp
+
+class ImportProfiler:
+    """
+    Measures how long the modules imported on the main thread take to load, including
+    everything they import themselves, and reports them at each stage of the startup.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.import_times = {}
+        self.depth = 0
+        self.builtin_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def timed_import(self, name, *args, **kwargs):
+        if current_thread() is not main_thread() or name in sys.modules:
+            return self.builtin_import(name, *args, **kwargs)
+
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            return self.builtin_import(name, *args, **kwargs)
+        finally:
+            self.depth -= 1
+            # Nested imports are included in the time of the module that caused them
+            if self.depth == 0:
+                self.import_times[name] = self.import_times.get(name, 0) + time.perf_counter() - start
+
+    def report(self, stage):
+        elapsed = time.perf_counter() - self.start_time
+        print(f'{stage} after {round(elapsed * 1000)} ms, imports:', file=sys.stderr)
+        for name, seconds in sorted(self.import_times.items(), key=lambda item: -item[1]):
+            print(f'  {name:<30} {round(seconds * 1000, 1):>8} ms', file=sys.stderr)
+        self.import_times.clear()
+
+
+profiler = None
 
 
 class MainApp:
@@ -27,21 +65,31 @@ class MainApp:
         self.multi_source_button.place(relx=0.6, rely=0.5, anchor=CENTER)
 
     def start_single_source(self):
+        from single_source_app import SingleSourceApp
+
         single_source_app = SingleSourceApp(self.top, tpu=tpu)
         single_source_app.run()
+        if profiler:
+            profiler.report('Single source mode ready')
 
     def start_multi_source(self):
+        from multi_source_app import MultiSourceApp
+
         multi_source_app = MultiSourceApp(self.top)
         multi_source_app.run()
+        if profiler:
+            profiler.report('Multi source mode ready')
 
 
 if __name__ == '__main__':
     args = sys.argv
-    tpu = False
-    if len(args) > 1 and args[1] == '--tpu':
-        tpu = True
+    tpu = '--tpu' in args[1:]
+    if '--profile-startup' in args[1:]:
+        profiler = ImportProfiler()
     try:
         app = MainApp()
+        if profiler:
+            app.top.after_idle(profiler.report, 'Mode menu shown')
         app.top.mainloop()
     except Exception:
         sys.exit()
@@ -0,0 +1,223 @@
+import json
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# Upper bounds of the latency buckets in seconds, from well below a model invoke to far over the chunk budget
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """
+    Streaming histogram over fixed buckets, so it takes the same memory after a minute
+    or after weeks. Quantiles are interpolated within the bucket they fall into.
+    """
+    type = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value, count=1):
+        """
+        Records a value, count times, e.g. the per-frame time of a batch of count frames.
+        """
+        self.counts[bisect_left(self.buckets, value)] += count
+        self.count += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.mean, 'max': self.max,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+class Counter:
+    """
+    Monotonic count, either incremented or read from a function when collected.
+    """
+    type = 'counter'
+
+    def __init__(self, function=None):
+        self.function = function
+        self.count = 0
+
+    def inc(self, count=1):
+        self.count += count
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self.count
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """
+    Value that goes up and down, either set or read from a function when collected.
+    """
+    type = 'gauge'
+
+    def __init__(self, function=None):
+        self.function = function
+        self.current = 0.0
+
+    def set(self, value):
+        self.current = value
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self.current
+
+    def snapshot(self):
+        return self.value
+
+
+def escape_label_value(value):
+    # Source ids are file paths or device names, which may contain any of these
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = sorted(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label_value(value)}"' for key, value in pairs) + '}'
+
+
+def format_value(value):
+    return 'NaN' if value is None else repr(float(value))
+
+
+class Registry:
+    """
+    Named metrics of the process, each name with any number of label combinations.
+    Asking for a metric that already exists returns it, so predictors of a restarted
+    app keep adding to the same series.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.descriptions = {}
+        self.lock = Lock()
+
+    def get(self, cls, name, description, labels, **kwargs):
+        key = name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+        with self.lock:
+            if key not in self.metrics:
+                self.metrics[key] = cls(**kwargs)
+                self.descriptions[name] = description
+            metric = self.metrics[key]
+            # A new function replaces the old one, the object it reads from may have been replaced
+            if kwargs.get('function') is not None:
+                metric.function = kwargs['function']
+            return metric
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS, **labels):
+        return self.get(Histogram, name, description, labels, buckets=buckets)
+
+    def counter(self, name, description, function=None, **labels):
+        return self.get(Counter, name, description, labels, function=function)
+
+    def gauge(self, name, description, function=None, **labels):
+        return self.get(Gauge, name, description, labels, function=function)
+
+    def snapshot(self):
+        """
+        Current values of all metrics, as {name: [{'labels': {...}, 'value': ...}]}.
+        Histograms are summarized by their count, sum, mean, max and quantiles.
+        """
+        with self.lock:
+            items = sorted(self.metrics.items())
+        snapshot = {}
+        for (name, labels), metric in items:
+            snapshot.setdefault(name, []).append({'labels': dict(labels), 'value': metric.snapshot()})
+        return snapshot
+
+    def to_prometheus(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            items = sorted(self.metrics.items())
+
+        lines = []
+        for i, ((name, labels), metric) in enumerate(items):
+            labels = dict(labels)
+            if not i or items[i - 1][0][0] != name:
+                description = self.descriptions[name].replace('\\', '\\\\').replace('\n', '\\n')
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric.type}')
+
+            if metric.type != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(metric.value)}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), metric.counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(metric.sum)}')
+            lines.append(f'{name}_count{format_labels(labels)} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of the whole process, used by the predictors unless given their own registry
+registry = Registry()
+
+
+def serve(registry=registry, port=9100, host='127.0.0.1'):
+    """
+    Serves the metrics over HTTP on a background thread, in Prometheus text format
+    on /metrics and as a JSON snapshot on /snapshot.
+
+    Returns:
+        The server, stop it with shutdown()
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = registry.to_prometheus().encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/snapshot':
+                body, content_type = json.dumps(registry.snapshot()).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood the output
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,107 @@
+import os
+import pathlib
+from threading import Lock
+
+import numpy as np
+
+MODELS_DIR = os.path.join(pathlib.Path(__file__).parent.absolute(), 'models')
+
+# Allocated interpreters shared by the whole process, keyed by model, delegate, thread count and instance
+interpreters = {}
+delegates = {}
+lock = Lock()
+
+# Interpreters allocated for batches of inputs, keyed like interpreters plus the batch size,
+# and the key each shared interpreter was loaded with
+batch_interpreters = {}
+interpreter_keys = {}
+
+
+def available_models():
+    """
+    Names of all TFLite models shipped in the models directory.
+    """
+    return sorted(name[:-len('.tflite')] for name in os.listdir(MODELS_DIR) if name.endswith('.tflite'))
+
+
+def warm_up(interpreter, input_details, runs):
+    """
+    Invokes the model a few times on silence, so the first real frame does not pay for the cold start.
+    """
+    zeros = np.zeros(input_details['shape'], dtype=input_details['dtype'])
+    for _ in range(runs):
+        interpreter.set_tensor(input_details['index'], zeros)
+        interpreter.invoke()
+
+
+def create_interpreter(name, delegate=None, num_threads=None, batch_size=None):
+    # The TFLite runtime is only imported when the first model is loaded
+    import tflite_runtime.interpreter as tflite
+
+    model_file = os.path.join(MODELS_DIR, name + '.tflite')
+
+    experimental_delegates = None
+    if delegate is not None:
+        if delegate not in delegates:
+            delegates[delegate] = tflite.load_delegate(delegate)
+        experimental_delegates = [delegates[delegate]]
+
+    interpreter = tflite.Interpreter(model_path=model_file, num_threads=num_threads,
+                                     experimental_delegates=experimental_delegates)
+    if batch_size is not None:
+        input_details = interpreter.get_input_details()[0]
+        interpreter.resize_tensor_input(input_details['index'], [batch_size, *input_details['shape'][1:]])
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def load_model(name, delegate=None, num_threads=None, warmup_runs=3, instance=None):
+    """
+    Returns an allocated and warmed up interpreter for a model from the models directory,
+    together with its input and output details. Every model is only loaded once per process and
+    instance, so creating another predictor for the same model reuses the interpreter.
+
+    Args:
+        name: model file name without the .tflite extension
+        delegate: shared library of a TFLite delegate, e.g. 'libedgetpu.so.1' for the Edge TPU
+        num_threads: number of threads TFLite may use for the model
+        warmup_runs: number of invocations done on load
+        instance: anything identifying a separate copy of the model, for predictors that run
+            at the same time as others and so cannot share their interpreters
+    """
+    # Not an OSError, which the apps take for a missing audio device
+    if name not in available_models():
+        raise ValueError(f'Model {name} not found in {MODELS_DIR}, '
+                         f'available models: {", ".join(available_models())}')
+
+    key = name, delegate, num_threads, instance
+    with lock:
+        if key not in interpreters:
+            interpreter = create_interpreter(name, delegate, num_threads)
+            input_details = interpreter.get_input_details()[0]
+            output_details = interpreter.get_output_details()[0]
+            warm_up(interpreter, input_details, warmup_runs)
+
+            interpreters[key] = interpreter, input_details, output_details
+            interpreter_keys[id(interpreter)] = key
+
+        return interpreters[key]
+
+
+def load_batch_model(interpreter, batch_size):
+    """
+    Returns an interpreter of the same model as one returned by load_model, allocated for batches
+    of batch_size inputs, together with its input and output details. Like load_model, every batch
+    size is only allocated once per process, so running a batch never resizes an interpreter.
+    Only models with a dynamic batch dimension can be loaded, the Edge TPU models take single inputs.
+    """
+    with lock:
+        name, delegate, num_threads, _ = key = interpreter_keys[id(interpreter)]
+        if key + (batch_size,) not in batch_interpreters:
+            batch_interpreter = create_interpreter(name, delegate, num_threads, batch_size)
+            input_details = batch_interpreter.get_input_details()[0]
+            output_details = batch_interpreter.get_output_details()[0]
+            warm_up(batch_interpreter, input_details, 1)
+            batch_interpreters[key + (batch_size,)] = batch_interpreter, input_details, output_details
+
+        return batch_interpreters[key + (batch_size,)]
@@ -5,27 +5,6 @@ from utils import UI_RESOLUTION
 
 
 class MultiSourceApp(DoaApp):
-    def color_arcs(self, C, predictions):
-        arcs = []
-        for angle, conf in predictions:
-            R = self.RADIUS * conf ** 0.5
-            x_1 = y_1 = self.DIM / 2 - R
-
-            coord = x_1, y_1, x_1 + 2 * R, y_1 + 2 * R
-
-            if conf > 0.5:
-                fill = '#78ebb3'
-                outline = '#2ca86b'
-                arc = C.create_arc(coord, start=angle - 5, extent=UI_RESOLUTION, fill=fill, outline=outline,
-                                   width=2)
-                arcs.append(arc)
-
-        self.top.update()
-
-        # Delete all arcs to draw them again at next iteration
-        for arc in arcs:
-            C.delete(arc)
-
     def create_title_label(self):
         super().create_title_label()
         label = Label(self.data_frame, text="Multi source")
@@ -51,38 +30,38 @@ class MultiSourceApp(DoaApp):
         return azimuth_label_1, azimuth_val_1, az_conf_label_1, az_conf_val_1, \
             azimuth_label_2, azimuth_val_2, az_conf_label_1, az_conf_val_2
 
-    def run(self):
-        C = self.create_canvas()
-        az_label, az_val, az_conf_label, az_conf_val, el_label, el_val, el_conf_label, el_conf_val = self.create_labels()
-
-        predictor = self.get_predictor('multi')
-        if not predictor:
-            return
-
-        while True:
-            predictor.is_active = self.prediction_running
-            predictions = predictor.az_current_predictions
-
-            # Color arcs based on model probabilities
-            try:
-                angles = [(angle * UI_RESOLUTION, conf) for angle, conf in enumerate(predictions) if conf > 0.5]
-                angles = sorted(angles, key=lambda x: x[1])[-2:]
-                self.color_arcs(C, angles)
-                if len(angles) == 1:
-                    az_val.config(text=f'{angles[0][0]}\N{DEGREE SIGN}')
-                    az_conf_val.config(text=f'{round(angles[0][1] * 100, 1)}%')
-                    el_val.config(text='-')
-                    el_conf_val.config(text='-')
-                elif len(angles) == 2:
-                    az_val.config(text=f'{angles[0][0]}\N{DEGREE SIGN}')
-                    az_conf_val.config(text=f'{round(angles[0][1] * 100, 1)}%')
-                    el_val.config(text=f'{angles[1][0]}\N{DEGREE SIGN}')
-                    el_conf_val.config(text=f'{round(angles[1][1] * 100, 1)}%')
-                elif len(angles) == 0:
-                    az_val.config(text='-')
-                    az_conf_val.config(text='-')
-                    el_val.config(text='-')
-                    el_conf_val.config(text='-')
-            except TclError:
-                predictor.is_active = False
-                return
+    def create_widgets(self):
+        self.az_label, self.az_val, self.az_conf_label, self.az_conf_val, \
+            self.el_label, self.el_val, self.el_conf_label, self.el_conf_val = self.create_labels()
+
+        return self.get_predictor('multi')
+
+    def update_view(self):
+        predictor = self.predictor
+        predictor.is_active = self.prediction_running
+        predictions = predictor.az_current_predictions
+
+        # Color arcs based on model probabilities
+        angles = [(angle * UI_RESOLUTION, conf) for angle, conf in enumerate(predictions) if conf > 0.5]
+        angles = sorted(angles, key=lambda x: x[1])[-2:]
+
+        confs = [None] * (360 // UI_RESOLUTION)
+        for angle, conf in angles:
+            confs[angle // UI_RESOLUTION] = conf
+        self.renderer.draw(confs, lambda i: True)
+
+        if len(angles) == 1:
+            self.az_val.config(text=f'{angles[0][0]}\N{DEGREE SIGN}')
+            self.az_conf_val.config(text=f'{round(angles[0][1] * 100, 1)}%')
+            self.el_val.config(text='-')
+            self.el_conf_val.config(text='-')
+        elif len(angles) == 2:
+            self.az_val.config(text=f'{angles[0][0]}\N{DEGREE SIGN}')
+            self.az_conf_val.config(text=f'{round(angles[0][1] * 100, 1)}%')
+            self.el_val.config(text=f'{angles[1][0]}\N{DEGREE SIGN}')
+            self.el_conf_val.config(text=f'{round(angles[1][1] * 100, 1)}%')
+        elif len(angles) == 0:
+            self.az_val.config(text='-')
+            self.az_conf_val.config(text='-')
+            self.el_val.config(text='-')
+            self.el_conf_val.config(text='-')
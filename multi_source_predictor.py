@@ -1,77 +1,91 @@
-import os
-import pathlib
+import time
 
-import tflite_runtime.interpreter as tflite
-
-from predictor import Predictor, get_mic_data, get_input_matrix, get_model_details
+from model_registry import load_model
+from predictor import Predictor, get_input_matrix, invoke_batch
+from tracker import DoaTracker
 from utils import *
 
 
-def init_models():
+def init_models(num_threads=None, instance=None):
     print('Loading models...')
-    # Load the TFLite model and allocate tensors.
-    base_dir = pathlib.Path(__file__).parent.absolute()
-    az_model_file = os.path.join(base_dir, 'models', 'best_multi_source_model_2.tflite')
-    az_interpreter = tflite.Interpreter(model_path=az_model_file)
-
-    print('Allocating tensors...')
-    az_interpreter.allocate_tensors()
-    print('Tensors allocated.\n')
-
-    # Get input and output tensors for the model
-    az_input_details, az_input_shape, az_output_details, az_output_shape = get_model_details(az_interpreter)
+    # Get an allocated TFLite interpreter, only loaded the first time it is used
+    az_interpreter, az_input_details, az_output_details = load_model('best_multi_source_model_2',
+                                                                     num_threads=num_threads, instance=instance)
 
-    print('Azimuth model input tensor: ' + str(az_input_shape))
-    print('Azimuth model output tensor: ' + str(az_output_shape))
+    print('Azimuth model input tensor: ' + str(az_input_details['shape']))
+    print('Azimuth model output tensor: ' + str(az_output_details['shape']))
     print('\nModels ready. Press Start to begin inference.\n')
 
     return az_interpreter, az_input_details, az_output_details
 
 
 class MultiSourcePredictor(Predictor):
-    def __init__(self, lines, fig, thresh=50, max_silence_frames=10):
-        super().__init__(lines, fig, thresh, max_silence_frames)
+    def __init__(self, lines, fig, thresh=50, max_silence_frames=10, autostart=True, num_threads=None, **kwargs):
+        super().__init__(lines, fig, thresh, max_silence_frames, **kwargs)
         self.az_current_predictions = []
 
-        self.stream = self.p.open(
-            format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-            frames_per_buffer=CHUNK, stream_callback=self.callback
-        )
-
-        self.stream.start_stream()
-        self.az_interpreter, self.az_input_details, self.az_output_details = init_models()
-
-    def callback(self, in_data, frame_count, time_info, status):
-        data, mic_data = get_mic_data(in_data)
-
-        if self.is_active:
-            self.mic_data = mic_data
-
-        if abs(np.max(mic_data)) > self.thresh and self.is_active:
-            self.az_current_predictions = self.get_prediction_from_model(mic_data)
-        else:
-            if self.silent_frames == self.max_silence_frames:
-                self.silent_frames = 0
-                self.az_current_predictions = []
-            self.silent_frames += 1
-        if self.is_active:
-            self.output_predictions()
-
-        return data, pyaudio.paContinue
-
-    def get_prediction_from_model(self, mic_data):
-        input_data = get_input_matrix(mic_data)
-
-        # Set input and run azimuth interpreter
-        self.az_interpreter.set_tensor(self.az_input_details['index'], input_data)
+        self.az_interpreter, self.az_input_details, self.az_output_details = init_models(
+            num_threads, self.get_model_instance())
+
+        # Output of the last single frame prediction, copied out of the output tensor
+        self.az_output_data = np.empty(self.az_output_details['shape'][1:], dtype=np.float32)
+
+        if autostart:
+            self.start()
+
+    def set_prediction(self, prediction):
+        self.az_current_predictions = prediction if prediction is not None else []
+        return [(angle * UI_RESOLUTION, conf) for angle, conf in enumerate(self.az_current_predictions) if conf > 0.5]
+
+    def create_tracker(self):
+        # Up to two sources, a source is only reported once it showed up in two frames
+        return DoaTracker(max_tracks=2, birth_hits=2)
+
+    def update_tracks(self, measurements):
+        """
+        Replaces the model output with the confidences of the tracked sources at their sectors,
+        extrapolated if there are no measurements.
+        """
+        tracks = self.tracker.step(measurements)
+        predictions = np.zeros(360 // UI_RESOLUTION)
+        for track in tracks:
+            sector = round(track.azimuth / UI_RESOLUTION) % len(predictions)
+            predictions[sector] = max(predictions[sector], track.confidence)
+        self.az_current_predictions = predictions
+
+    def predict_frame(self, mic_data, spectra=None):
+        # Write the GCC matrix straight into the input tensor, the view must be gone before invoking
+        start_time = time.perf_counter()
+        input_data = self.az_interpreter.tensor(self.az_input_details['index'])()
+        get_input_matrix(mic_data, input_data, self.gcc_workspace, spectra)
+        del input_data
+        self.observe('gcc', time.perf_counter() - start_time)
+
+        # Run azimuth interpreter
+        start_time = time.perf_counter()
         self.az_interpreter.invoke()
-        az_output_data = self.az_interpreter.get_tensor(self.az_output_details['index'])
-        return az_output_data[0]
-
-    def output_predictions(self):
-        predictions = [(angle * UI_RESOLUTION, round(conf, 3))
-                       for angle, conf in enumerate(self.az_current_predictions) if conf > 0.5]
-        if len(predictions):
-            print(predictions)
-        else:
-            print('[No prediction]')
+        self.az_output_data[:] = self.az_interpreter.tensor(self.az_output_details['index'])()[0]
+        self.observe('azimuth', time.perf_counter() - start_time)
+        return self.az_output_data
+
+    def predict_batch(self, mic_frames, spectra=None):
+        """
+        Batched version of predict_frame, running the model once for all frames.
+        """
+        return self.get_predictions_from_inputs(self.get_input_batch(mic_frames, spectra))
+
+    def get_predictions_from_inputs(self, input_batch):
+        """
+        Runs the model on a batch of input matrices that are already computed, such as cached features.
+        """
+        start_time = time.perf_counter()
+        az_output_batch = invoke_batch(self.az_interpreter, self.az_input_details, self.az_output_details,
+                                       input_batch)
+        self.observe('azimuth', (time.perf_counter() - start_time) / len(input_batch), len(input_batch))
+        return az_output_batch
+
+    def get_prediction_event(self):
+        sources = [{'azimuth': angle * UI_RESOLUTION, 'confidence': round(float(conf), 3)}
+                   for angle, conf in enumerate(self.az_current_predictions) if conf > 0.5]
+        sources.sort(key=lambda source: source['confidence'], reverse=True)
+        return {'timestamp': time.time(), 'frame': self.frame_index, 'mode': 'multi', 'sources': sources}
@@ -0,0 +1,74 @@
+from utils import *
+
+# Geometry of the MiniDSP UMA-8 array: 6 microphones on a circle, the first one at 0 degrees
+MIC_RADIUS = 0.045
+N_MICS = 6
+SPEED_OF_SOUND = 343.0
+
+
+class MusicEngine:
+    """
+    MUSIC azimuth estimator for the circular microphone array.
+
+    The array geometry and the steering vectors for the frequency bins in use are computed
+    once, so every frame only needs the spatial covariance matrices, their eigendecomposition
+    and one batched matmul over the azimuth grid. With coarse_step > 1, the pseudo-spectrum is
+    first evaluated on every coarse_step-th grid point and then refined around the best one.
+    """
+
+    def __init__(self, nfft=256, n_grid=360 // AZIMUTH_RESOLUTION, freq_range=(500.0, 4000.0), num_src=1,
+                 coarse_step=1):
+        self.nfft = nfft
+        self.num_src = num_src
+        self.coarse_step = coarse_step
+
+        # Same frequency bins pyroomacoustics uses for the given frequency range
+        self.freq_bins = np.arange(int(np.round(freq_range[0] / RATE * nfft)),
+                                   int(np.round(freq_range[1] / RATE * nfft)) + 1)
+        freq_hz = self.freq_bins * RATE / nfft
+
+        mic_angles = 2 * np.pi * np.arange(N_MICS) / N_MICS
+        self.mic_positions = MIC_RADIUS * np.stack([np.cos(mic_angles), np.sin(mic_angles)])
+        self.grid = np.linspace(0, 2 * np.pi, n_grid, endpoint=False)
+
+        # Far-field steering vectors, shape (freq, mic, grid)
+        directions = np.stack([np.cos(self.grid), np.sin(self.grid)])
+        delays = self.mic_positions.T @ directions / SPEED_OF_SOUND
+        self.steering = np.exp(2j * np.pi * freq_hz[:, np.newaxis, np.newaxis] * delays)
+
+    def pseudo_spectrum(self, noise_subspace, grid_idx=slice(None)):
+        steering = self.steering[:, :, grid_idx]
+
+        # |a^H En|^2 summed over the noise subspace, for every frequency and grid point at once
+        projection = np.conj(np.swapaxes(noise_subspace, 1, 2)) @ steering
+        denominator = np.sum(np.abs(projection) ** 2, axis=1)
+        return np.mean(1 / denominator, axis=0)
+
+    def locate_source(self, stft_data):
+        """
+        Estimates the azimuth of the dominant source.
+
+        Args:
+            stft_data: STFT of the 6 microphone channels with shape (mic, freq, frames),
+                as returned by compute_stft_matrix
+
+        Returns:
+            Azimuth in degrees
+        """
+        X = np.swapaxes(stft_data[:, self.freq_bins, :], 0, 1)
+
+        # Spatial covariance matrix and its noise subspace for every frequency bin
+        covariance = X @ np.conj(np.swapaxes(X, 1, 2)) / X.shape[2]
+        _, eigenvectors = np.linalg.eigh(covariance)
+        noise_subspace = eigenvectors[:, :, :N_MICS - self.num_src]
+
+        n_grid = len(self.grid)
+        if self.coarse_step > 1:
+            coarse_idx = np.arange(0, n_grid, self.coarse_step)
+            best = coarse_idx[np.argmax(self.pseudo_spectrum(noise_subspace, coarse_idx))]
+            fine_idx = np.arange(best - self.coarse_step + 1, best + self.coarse_step) % n_grid
+            best = fine_idx[np.argmax(self.pseudo_spectrum(noise_subspace, fine_idx))]
+        else:
+            best = np.argmax(self.pseudo_spectrum(noise_subspace))
+
+        return round(math.degrees(self.grid[best])) % 360
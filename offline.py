@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""
+Runs DOA estimation over directories of multichannel recordings, such as the
+recording_angle_*.wav files written by record.py, using all CPU cores.
+
+Usage: python3 offline.py single|multi <directory or WAV files...> [--workers N] [--threads N]
+                                       [--batch N] [--hop N] [--output predictions.csv] [--cache [DIR]]
+
+With --cache, the GCC features of every recording are computed once and kept on disk,
+so later runs over the same recordings only run the models.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import lru_cache
+
+from audio_source import ReplaySource, open_wav, to_device_layout
+from feature_cache import CACHE_DIR, load_features
+from predictor import get_mic_data
+from utils import *
+
+# Predictor of the worker process, with its own warm interpreters
+worker_predictor = None
+worker_mode = None
+# Feature cache directory of the worker process, None to compute features from the audio
+worker_cache_dir = None
+
+
+def init_worker(mode, tpu, num_threads, cache_dir=None):
+    global worker_predictor, worker_mode, worker_cache_dir
+    worker_mode = mode
+    worker_cache_dir = cache_dir
+
+    # An empty replay source, offline workers never open an audio stream
+    source = ReplaySource(np.zeros((0, CHANNELS), dtype=np.int16))
+    # Model loading messages of every worker would only clutter the progress output
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if mode == 'single':
+            from single_source_predictor import SingleSourcePredictor
+            worker_predictor = SingleSourcePredictor(None, None, tpu=tpu, source=source, autostart=False,
+                                                     verbose=False, num_threads=num_threads)
+        else:
+            from multi_source_predictor import MultiSourcePredictor
+            worker_predictor = MultiSourcePredictor(None, None, source=source, autostart=False,
+                                                    verbose=False, num_threads=num_threads)
+
+
+@lru_cache(maxsize=2)
+def open_recording(path):
+    # Memory-mapped, so only the frames of a shard are ever read into memory
+    return open_wav(path)
+
+
+def read_mic_frame(recording, start):
+    _, mic_data = get_mic_data(to_device_layout(recording[start:start + CHUNK]).tobytes())
+    return mic_data
+
+
+def get_frame_starts(path, hop):
+    if worker_cache_dir is not None:
+        # Builds the cache of the file if it is missing or out of date
+        n_frames = len(load_features(path, hop=hop, cache_dir=worker_cache_dir))
+        return list(range(0, n_frames * hop, hop))
+
+    n_samples = len(open_recording(path))
+    return list(range(0, n_samples - CHUNK + 1, hop))
+
+
+def process_shard(path, starts, hop):
+    """
+    Runs the worker's models on the frames of a file starting at the given samples, as one batch.
+
+    Returns:
+        One result row per frame
+    """
+    if worker_cache_dir is not None:
+        features = load_features(path, hop=hop, cache_dir=worker_cache_dir)
+        input_batch = features[starts[0] // hop:starts[-1] // hop + 1]
+    else:
+        recording = open_recording(path)
+        input_batch = worker_predictor.get_input_batch([read_mic_frame(recording, start) for start in starts])
+
+    if worker_mode == 'multi':
+        outputs = worker_predictor.get_predictions_from_inputs(input_batch)
+        return [[sources_to_string(output)] for output in outputs]
+
+    predictions = worker_predictor.predict_inputs(input_batch)
+    return [[az_pred, round(float(az_conf), 4), el_pred, round(float(el_conf), 4)]
+            for (az_pred, az_conf), (el_pred, el_conf) in predictions]
+
+
+def sources_to_string(output):
+    return ' '.join(f'{angle * UI_RESOLUTION}:{round(float(conf), 3)}'
+                    for angle, conf in enumerate(output) if conf > 0.5)
+
+
+def find_recordings(paths):
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            recordings += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.wav'))
+        else:
+            recordings.append(path)
+    return recordings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline DOA estimation of multichannel recordings.')
+    parser.add_argument('mode', choices=['single', 'multi'])
+    parser.add_argument('paths', nargs='+', help='WAV files or directories containing them')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='TFLite threads per interpreter')
+    parser.add_argument('--batch', type=int, default=32, help='frames per model invocation')
+    parser.add_argument('--hop', type=int, default=CHUNK, help='samples between consecutive frames')
+    parser.add_argument('--tpu', action='store_true', help='use the Edge TPU azimuth model (single mode)')
+    parser.add_argument('--output', default='predictions.csv', help='CSV file to write the predictions to')
+    parser.add_argument('--cache', nargs='?', const=CACHE_DIR,
+                        help=f'cache the features of the recordings in this directory, {CACHE_DIR} by default')
+    args = parser.parse_args()
+
+    recordings = find_recordings(args.paths)
+    if not recordings:
+        sys.exit('No recordings found.')
+
+    if args.mode == 'single':
+        header = ['file', 'frame', 'time', 'azimuth', 'azimuth_confidence', 'elevation', 'elevation_confidence']
+    else:
+        header = ['file', 'frame', 'time', 'sources']
+
+    start_time = time.perf_counter()
+    n_frames = 0
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.mode, args.tpu, args.threads, args.cache)) as executor, \
+            open(args.output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+
+        # Split every file into shards of consecutive frames, processed in order
+        shards = []
+        for path, starts in zip(recordings, executor.map(get_frame_starts, recordings,
+                                                         [args.hop] * len(recordings))):
+            shards += [(path, starts[i:i + args.batch]) for i in range(0, len(starts), args.batch)]
+
+        results = executor.map(process_shard, *zip(*shards), [args.hop] * len(shards)) if shards else []
+        for (path, starts), rows in zip(shards, results):
+            for start, row in zip(starts, rows):
+                writer.writerow([os.path.basename(path), start // args.hop, round(start / RATE, 4)] + row)
+            n_frames += len(starts)
+
+    elapsed = time.perf_counter() - start_time
+    audio_length = n_frames * args.hop / RATE
+    print(f'Processed {n_frames} frames ({round(audio_length, 1)} s of audio) from {len(recordings)} files '
+          f'in {round(elapsed, 1)} s, {round(audio_length / elapsed, 1)}x real time.')
+    print(f'Predictions written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,18 @@
 import platform
-from threading import Thread
+import sys
+import time
+import traceback
+from threading import Thread, current_thread
 
-from alsa_suppress import noalsaerr
+from audio_source import PyAudioSource
+from frame_buffer import FrameBuffer
+from gate import ActivityGate
+from metrics import registry
+from model_registry import load_batch_model
+from publishers import ConsolePublisher, EventWriter
+from signal_plot import SignalPlot
+from sliding_window import SlidingWindow
+from tracker import DoaTracker
 from utils import *
 
 
@@ -10,57 +21,403 @@ def get_mic_data(in_data):
     data = np.reshape(data, (-1, CHANNELS))
     # Drop irrelevant channels and reorder remaining channels,
     # in order to match the simulated microphone array
-    mic_data = np.hstack([data[:, 1].reshape(-1, 1), data[:, -2:1:-1]])
+    mic_data = select_mic_channels(data, np.empty((len(data), CHANNELS - 2), dtype=np.int16))
     return data, mic_data
 
 
-def get_input_matrix(mic_data):
-    gcc_matrix = np.transpose(compute_gcc_matrix(mic_data))
-    input_data = np.array([gcc_matrix], dtype=np.float32)
+def get_input_matrix(mic_data, out=None, workspace=None, spectra=None):
+    # The models take the transposed GCC matrix, so write it through a transposed view
+    input_data = np.empty((1, 2 * gcc_max_len() + 1, len(MIC_PAIRS)), dtype=np.float32) if out is None else out
+    compute_gcc_matrix(mic_data, out=input_data[0].T, spectra=spectra, workspace=workspace)
     return input_data
 
 
-def get_model_details(az_interpreter):
-    az_input_details = az_interpreter.get_input_details()[0]
-    az_output_details = az_interpreter.get_output_details()[0]
-    az_input_shape = az_input_details['shape']
-    az_output_shape = az_output_details['shape']
-    return az_input_details, az_input_shape, az_output_details, az_output_shape
+def get_input_batch(mic_frames, out=None, workspace=None, spectra=None):
+    """
+    Stacks the input matrices of several frames into one batch, written to out if given.
+    Spectra already computed for some of the frames can be given, None for the others.
+    """
+    input_batch = np.empty((len(mic_frames), 2 * gcc_max_len() + 1, len(MIC_PAIRS)), dtype=np.float32) \
+        if out is None else out
+    if spectra is None:
+        spectra = [None] * len(mic_frames)
+    for input_data, mic_data, X in zip(input_batch, mic_frames, spectra):
+        compute_gcc_matrix(mic_data, out=input_data.T, spectra=X, workspace=workspace)
+    return input_batch
+
+
+def invoke_batch(interpreter, input_details, output_details, input_batch):
+    """
+    Runs a model on a whole batch of inputs. Models with a dynamic batch dimension run once on
+    an interpreter allocated for the batch size, others, such as the Edge TPU models, once per input.
+
+    Returns:
+        Model outputs, one row per frame
+    """
+    if len(input_batch) > 1 and input_details['shape_signature'][0] == -1:
+        interpreter, input_details, output_details = load_batch_model(interpreter, len(input_batch))
+        interpreter.set_tensor(input_details['index'], input_batch.astype(input_details['dtype'], copy=False))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_details['index'])
+
+    outputs = []
+    for input_data in input_batch:
+        interpreter.set_tensor(input_details['index'], input_data[np.newaxis].astype(input_details['dtype']))
+        interpreter.invoke()
+        outputs.append(interpreter.get_tensor(output_details['index'])[0])
+    return np.array(outputs)
 
 
 class Predictor:
-    def __init__(self, lines, fig, thresh=50, max_silence_frames=10):
+    # Stages timed in the doa_stage_seconds histograms
+    STAGES = ('gate', 'gcc', 'azimuth', 'elevation', 'music', 'render')
+
+    def __init__(self, lines, fig, thresh=50, max_silence_frames=10, source=None, active=False,
+                 queue_size=4, drop_policy='drop-oldest', verbose=True, max_batch=8, hop=CHUNK, gate=None,
+                 track=False, tracker=None, decimation=1, max_track_std=None, scheduler=None, source_id=None,
+                 metrics=None, plot_fps=15):
         # Model parameters
-        self.is_active = False
+        self.is_active = active
 
-        # Thresholds for deciding whether to run or not
-        self.thresh = thresh
-        self.silent_frames = 0
-        self.max_silence_frames = max_silence_frames
+        # Tags the prediction events when several microphone arrays are served by one process
+        self.source_id = source_id
 
-        if platform.system() == 'Windows':
-            self.p = pyaudio.PyAudio()
-        else:
-            with noalsaerr():
-                self.p = pyaudio.PyAudio()
+        # Whether to print predictions, functions to call with every prediction event
+        # and functions to call with every raw audio block
+        self.verbose = verbose
+        self.listeners = []
+        self.taps = []
+        self.frame_index = 0
+
+        # Predictions are printed by a background writer, so a slow terminal cannot hold up inference
+        self.console = None
+        if verbose:
+            self.console = EventWriter([ConsolePublisher()], max_rate=20)
+            self.add_listener(self.console.publish)
+
+        # Decides whether to run or not, predictions are cleared after max_silence_frames inactive frames
+        self.gate = gate if gate is not None else ActivityGate(thresh, release_frames=max_silence_frames)
+
+        # Optional tracking of the predictions across frames. With decimation, the networks only run on
+        # every decimation-th active frame, or when the tracks are more uncertain than max_track_std
+        # degrees, and the tracks are extrapolated in between
+        if tracker is None and (track or decimation > 1 or max_track_std is not None):
+            tracker = self.create_tracker()
+        self.tracker = tracker
+        self.decimation = decimation
+        self.max_track_std = max_track_std
+        self.frames_since_inference = 0
+        self.decimated_frames = 0
+
+        # Capture from the microphone array unless another audio source is given
+        self.source = source if source is not None else PyAudioSource()
+
+        # A prediction is made every hop samples, over the last CHUNK samples
+        self.window = SlidingWindow(hop)
+
+        # Raw blocks waiting for the inference worker
+        self.frame_buffer = FrameBuffer(queue_size, drop_policy)
+
+        # Frames that queued up while the worker was busy are run through the models as one batch.
+        # With a scheduler, its shared worker runs inference instead of a worker of this predictor
+        self.max_batch = max_batch
+        self.scheduler = scheduler
+        self.worker = None
+        self.input_overflows = 0
+        self.reported_drops = 0
 
+        # Benchmarking the FFT backends must not hold up the first frames, so choose one now
+        get_fft_backend()
+
+        # Preallocated frames, GCC buffers and batched model inputs, so steady-state frames do not allocate
+        self.mic_frames = np.empty((max_batch, CHUNK, CHANNELS - 2), dtype=np.float32)
+        self.gcc_workspace = GccWorkspace()
+        self.input_batch = np.empty((max_batch, 2 * gcc_max_len() + 1, len(MIC_PAIRS)), dtype=np.float32)
+
+        # Signal plot, redrawn at most plot_fps times per second
         self.lines = lines
         self.fig = fig
+        self.plot_fps = plot_fps
 
-        self.cnn_exec_times = []
         self.mic_data = np.zeros((CHUNK, CHANNELS - 2))
 
-        if platform.system() == 'Windows':
+        # Stage latencies, frame counters and load, served by metrics.serve
+        self.metrics = metrics if metrics is not None else registry
+        self.init_metrics()
+
+        if platform.system() == 'Windows' and self.fig is not None:
             self.thread = Thread(target=self.update_signal_plot, daemon=True)
             self.thread.start()
 
+    def init_metrics(self):
+        labels = {'source': self.source_id} if self.source_id is not None else {}
+        self.stage_times = {stage: self.metrics.histogram('doa_stage_seconds', 'Time spent on a frame in each stage',
+                                                          stage=stage, **labels)
+                            for stage in self.STAGES}
+
+        self.metrics.counter('doa_frames_processed_total', 'Frames processed by the inference worker',
+                             lambda: self.frame_index, **labels)
+        self.metrics.counter('doa_frames_skipped_total', 'Frames the activity gate kept from the models',
+                             lambda: self.skipped_frames, **labels)
+        self.metrics.counter('doa_frames_decimated_total', 'Active frames the tracker extrapolated instead',
+                             lambda: self.decimated_frames, **labels)
+        self.metrics.counter('doa_frames_dropped_total', 'Blocks dropped because inference fell behind',
+                             lambda: self.dropped_frames, **labels)
+        self.metrics.counter('doa_input_overflows_total', 'Blocks PortAudio flagged with an input overflow',
+                             lambda: self.input_overflows, **labels)
+        self.metrics.gauge('doa_backlog_blocks', 'Blocks waiting for the inference worker',
+                           lambda: self.backlog, **labels)
+        self.callback_load = self.metrics.gauge(
+            'doa_callback_load', 'Duration of the last audio callback as a fraction of its block', **labels)
+        self.worker_load = self.metrics.gauge(
+            'doa_worker_load', 'Inference time of the last blocks as a fraction of their duration, '
+                               'inference falls behind above 1', **labels)
+
+    def get_model_instance(self):
+        """
+        Instance of the models in model_registry. Predictors share their interpreters, unless a scheduler
+        runs several of them at the same time, then every one has its own.
+        """
+        if self.scheduler is None or self.scheduler.workers == 1:
+            return None
+        return self.source_id if self.source_id is not None else id(self)
+
+    def observe(self, stage, seconds, count=1):
+        self.stage_times[stage].observe(seconds, count)
+
+    @property
+    def dropped_frames(self):
+        return self.frame_buffer.dropped_frames
+
+    @property
+    def backlog(self):
+        return len(self.frame_buffer)
+
+    @property
+    def skipped_frames(self):
+        return self.gate.skipped_frames
+
+    def start(self):
+        if self.scheduler is not None:
+            self.scheduler.add(self)
+        else:
+            self.worker = Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+        self.source.start(self.callback, frames_per_buffer=self.window.hop)
+
+    def callback(self, in_data, frame_count, time_info, status):
+        # Runs on the audio thread, so only hand the block over to the inference worker
+        start_time = time.perf_counter()
+        if status & PA_INPUT_OVERFLOW:
+            self.input_overflows += 1
+        for tap in self.taps:
+            tap(in_data)
+        self.frame_buffer.put(in_data)
+        if self.scheduler is not None:
+            self.scheduler.notify()
+        self.callback_load.set((time.perf_counter() - start_time) * RATE / frame_count)
+        return in_data, PA_CONTINUE
+
+    def run_worker(self):
+        while True:
+            in_data = self.frame_buffer.get()
+            if in_data is None:
+                return
+            self.process_blocks([in_data] + self.frame_buffer.get_pending(self.max_batch - 1))
+
+    def process_blocks(self, frames):
+        """
+        Runs inference on raw audio blocks taken from the frame buffer and marks them as done.
+        """
+        if self.dropped_frames > self.reported_drops:
+            self.reported_drops = self.dropped_frames
+            source = f' on source {self.source_id}' if self.source_id is not None else ''
+            print(f'Inference is falling behind{source}, {self.reported_drops} frames dropped so far.',
+                  file=sys.stderr)
+
+        start_time = time.perf_counter()
+        try:
+            self.process_frames(frames)
+        except Exception:
+            # A bad frame must not stop inference
+            traceback.print_exc()
+        finally:
+            self.frame_buffer.task_done(len(frames))
+        self.worker_load.set((time.perf_counter() - start_time) * RATE / (len(frames) * self.window.hop))
+
+    def read_frames(self, frames):
+        """
+        Turns raw audio blocks into the CHUNK long windows of microphone data the models expect.
+        Blocks that arrive before the first window is full do not produce a frame.
+        """
+        mic_frames = []
+        for in_data in frames:
+            block = np.frombuffer(in_data, dtype=np.int16).reshape(-1, CHANNELS)
+            if self.window.push(block):
+                mic_data = self.mic_frames[len(mic_frames)] if len(mic_frames) < len(self.mic_frames) \
+                    else np.empty_like(self.window.samples)
+                mic_data[:] = self.window.samples
+                mic_frames.append(mic_data)
+        return mic_frames
+
+    def gate_frames(self, mic_frames):
+        """
+        Runs the activity gate on every frame.
+
+        Returns:
+            For each frame, whether to run the models, whether the gate was open
+            and the spectra the gate computed
+        """
+        run_models, gate_open, spectra = [], [], []
+        for mic_data in mic_frames:
+            start_time = time.perf_counter()
+            run = self.gate.update(mic_data) and self.is_active
+            self.observe('gate', time.perf_counter() - start_time)
+            if run and self.tracker is not None and not self.needs_inference():
+                run = False
+                self.decimated_frames += 1
+            run_models.append(run)
+            gate_open.append(self.gate.is_open)
+            spectra.append(self.gate.spectra)
+        return run_models, gate_open, spectra
+
+    def create_tracker(self):
+        return DoaTracker(max_tracks=1)
+
+    def needs_inference(self):
+        """
+        Whether the networks have to run on the current active frame,
+        or the tracks can be extrapolated instead.
+        """
+        self.frames_since_inference += 1
+        if self.frames_since_inference >= self.decimation or not self.tracker.confirmed_tracks or \
+                (self.max_track_std is not None and self.tracker.uncertainty() > self.max_track_std):
+            self.frames_since_inference = 0
+            return True
+        return False
+
+    def get_input_batch(self, mic_frames, spectra=None):
+        """
+        Input matrices of several frames, written to the preallocated input buffer if they fit.
+        """
+        start_time = time.perf_counter()
+        out = self.input_batch[:len(mic_frames)] if len(mic_frames) <= len(self.input_batch) else None
+        input_batch = get_input_batch(mic_frames, out, self.gcc_workspace, spectra)
+        if len(mic_frames):
+            self.observe('gcc', (time.perf_counter() - start_time) / len(mic_frames), len(mic_frames))
+        return input_batch
+
+    def process_frames(self, frames):
+        """
+        Runs inference on one or more consecutive raw audio blocks.
+        """
+        mic_frames = self.read_frames(frames)
+        run_models, gate_open, spectra = self.gate_frames(mic_frames)
+
+        # Frames that queued up while the worker was busy go through the models as one batch
+        batch_predictions = None
+        if sum(run_models) > 1:
+            batch_predictions = iter(self.predict_batch(
+                [mic_data for mic_data, run in zip(mic_frames, run_models) if run],
+                [X for X, run in zip(spectra, run_models) if run]))
+
+        for mic_data, X, run, is_open in zip(mic_frames, spectra, run_models, gate_open):
+            self.process_frame(mic_data, run, batch_predictions, X, is_open)
+            self.frame_index += 1
+
+    def process_frame(self, mic_data, run_models, batch_predictions=None, spectra=None, gate_open=True):
+        if self.is_active:
+            self.mic_data = mic_data
+
+        if run_models:
+            if batch_predictions is not None:
+                measurements = self.set_prediction(next(batch_predictions))
+            else:
+                measurements = self.set_prediction(self.predict_frame(mic_data, spectra))
+            if self.tracker is not None:
+                self.update_tracks(measurements)
+        elif gate_open:
+            if self.tracker is not None:
+                self.update_tracks(None)
+        else:
+            self.set_prediction(None)
+            if self.tracker is not None:
+                self.tracker.reset()
+        if self.is_active:
+            self.notify_listeners()
+
+    def predict_frame(self, mic_data, spectra=None):
+        raise NotImplementedError
+
+    def predict_batch(self, mic_frames, spectra=None):
+        raise NotImplementedError
+
+    def set_prediction(self, prediction):
+        """
+        Makes a model prediction the current one, or clears it if None.
+
+        Returns:
+            The measurements of the prediction for the tracker
+        """
+        raise NotImplementedError
+
+    def update_tracks(self, measurements):
+        raise NotImplementedError
+
+    def get_prediction_event(self):
+        raise NotImplementedError
+
+    def add_listener(self, listener):
+        """
+        Registers a function to be called with the prediction event of every processed frame.
+        """
+        self.listeners.append(listener)
+
+    def add_tap(self, tap):
+        """
+        Registers a function to be called with every raw audio block, such as Recorder.put.
+        It runs on the audio thread, so it must not block.
+        """
+        self.taps.append(tap)
+
+    def notify_listeners(self):
+        if self.listeners:
+            event = self.get_prediction_event()
+            if self.source_id is not None:
+                event['source'] = self.source_id
+            for listener in self.listeners:
+                listener(event)
+
+    def join(self, timeout=None):
+        """
+        Waits until every captured frame has gone through inference.
+        """
+        return self.frame_buffer.join(timeout)
+
+    def close(self):
+        self.is_active = False
+        if self.scheduler is not None:
+            self.scheduler.remove(self)
+        # Close the buffer first, so a source waiting for space in it can stop
+        self.frame_buffer.close()
+        self.source.close()
+        # Interpreters are shared by the whole process, so the worker must be done with them
+        # before another predictor for the same models takes over
+        if self.worker is not None and self.worker is not current_thread():
+            self.worker.join()
+        if self.console is not None:
+            self.console.close()
+
     def update_signal_plot(self):
+        plot = SignalPlot(self.fig, self.lines, self.plot_fps)
+        plotted_frame = None
         while True:
-            for c in range(CHANNELS - 2):
-                mic_channel = self.mic_data[:, c]
-                self.lines[c].set_ydata(mic_channel)
+            # Only frames the worker has processed since the last redraw are new
+            if self.frame_index != plotted_frame:
+                plotted_frame = self.frame_index
+                plot.update(self.mic_data)
             try:
-                self.fig.canvas.draw()
-                self.fig.canvas.flush_events()
+                plot.draw()
             except Exception:
                 return
+            time.sleep(plot.interval / 2)
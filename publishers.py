@@ -0,0 +1,348 @@
+import csv
+import json
+import math
+import os
+import socket
+import struct
+import sys
+import time
+import traceback
+from threading import Lock, Thread
+
+from frame_buffer import FrameBuffer
+
+
+class Publisher:
+    """
+    Destination of prediction events. Publishers are written to by an EventWriter,
+    which hands them the events gathered since its last write in one batch.
+    """
+    failed = False
+
+    def publish(self, event):
+        raise NotImplementedError
+
+    def publish_batch(self, events):
+        for event in events:
+            self.publish(event)
+
+    def close(self):
+        pass
+
+
+class StdoutPublisher(Publisher):
+    """
+    Writes every prediction event to stdout as one line of JSON.
+    """
+
+    def format(self, event):
+        return json.dumps(event)
+
+    def publish(self, event):
+        self.publish_batch([event])
+
+    def publish_batch(self, events):
+        if self.failed:
+            return
+        try:
+            sys.stdout.write(''.join(self.format(event) + '\n' for event in events))
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The consumer has gone away, nothing more can be written
+            self.failed = True
+
+
+class ConsolePublisher(StdoutPublisher):
+    """
+    Prints prediction events to stdout in a human readable form, as the apps do.
+    """
+
+    def format(self, event):
+        source = f'[{event["source"]}] ' if 'source' in event else ''
+        if event['mode'] == 'multi':
+            if not event['sources']:
+                return source + '[No prediction]'
+            return source + str(sorted((s['azimuth'], s['confidence']) for s in event['sources']))
+
+        if event['azimuth'] is None:
+            return source + '{:<63}'.format('[No prediction]')
+        az_conf = round(event['azimuth_confidence'] * 100, 1)
+        el_conf = round(event['elevation_confidence'] * 100, 1)
+        return source + 'Azimuth: {:>3} degrees [{:>5}%] | Elevation: {:>3} degrees [{:>5}%]'.format(
+            event['azimuth'], az_conf, event['elevation'], el_conf)
+
+
+def get_event_rows(event):
+    """
+    Flattens an event into (timestamp, frame, source, azimuth, azimuth confidence, elevation,
+    elevation confidence) rows, one per detected source and a row of Nones without any.
+    """
+    head = event['timestamp'], event['frame'], event.get('source')
+    if event['mode'] == 'single':
+        return [head + (event['azimuth'], event['azimuth_confidence'],
+                        event['elevation'], event['elevation_confidence'])]
+    return [head + (source['azimuth'], source['confidence'], None, None) for source in event['sources']] or \
+        [head + (None, None, None, None)]
+
+
+class LogFilePublisher(Publisher):
+    """
+    Logs prediction events to a CSV file, or to a binary file of fixed size records if the path
+    does not end in .csv. Once a file reaches max_bytes, it is renamed to <path>.1, older files
+    are shifted up to <path>.<backup_count> and a new file is started.
+
+    Binary records are little endian (timestamp float64, frame uint32, source uint16, azimuth int16,
+    azimuth confidence float32, elevation int16, elevation confidence float32), with -1 for a missing
+    angle and NaN for a missing confidence. The source is the index of the array in sources, e.g. the
+    order the daemon was given its arrays in, sources missing from it are numbered on from there in
+    the order they first appear. Events without a source get 65535.
+    """
+    HEADER = ['timestamp', 'frame', 'source', 'azimuth', 'azimuth_confidence', 'elevation',
+              'elevation_confidence']
+    RECORD = struct.Struct('<dIHhfhf')
+    NO_SOURCE = 0xFFFF
+
+    def __init__(self, path, max_bytes=None, backup_count=5, sources=()):
+        self.path = path
+        self.source_indices = {source: i for i, source in enumerate(sources)}
+        self.binary = not path.endswith('.csv')
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        self.open()
+
+    def open(self):
+        if self.binary:
+            self.file = open(self.path, 'ab')
+        else:
+            self.file = open(self.path, 'a', newline='')
+            self.writer = csv.writer(self.file)
+            if self.file.tell() == 0:
+                self.writer.writerow(self.HEADER)
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backup_count:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def publish(self, event):
+        self.publish_batch([event])
+
+    def get_source_index(self, source):
+        if source is None:
+            return self.NO_SOURCE
+        return self.source_indices.setdefault(source, len(self.source_indices))
+
+    def publish_batch(self, events):
+        rows = [row for event in events for row in get_event_rows(event)]
+        if self.binary:
+            self.file.write(b''.join(self.RECORD.pack(
+                timestamp, frame, self.get_source_index(source), -1 if azimuth is None else azimuth,
+                math.nan if az_conf is None else az_conf, -1 if elevation is None else elevation,
+                math.nan if el_conf is None else el_conf)
+                for timestamp, frame, source, azimuth, az_conf, elevation, el_conf in rows))
+        else:
+            self.writer.writerows(rows)
+        self.file.flush()
+
+        if self.max_bytes is not None and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def close(self):
+        self.file.close()
+
+
+class UdpPublisher(Publisher):
+    """
+    Sends every prediction event as a JSON datagram to the given address.
+    """
+
+    def __init__(self, host, port):
+        self.address = host, port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, event):
+        try:
+            self.sock.sendto(json.dumps(event).encode() + b'\n', self.address)
+        except OSError:
+            # Nobody listening is not an error for a fire-and-forget stream
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class UnixSocketPublisher(Publisher):
+    """
+    Listens on a Unix domain socket and streams NDJSON prediction events to every connected client.
+    """
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.path = path
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+
+        self.clients = []
+        self.lock = Lock()
+        Thread(target=self.accept_clients, daemon=True).start()
+
+    def accept_clients(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.clients.append(client)
+
+    def publish(self, event):
+        self.publish_batch([event])
+
+    def publish_batch(self, events):
+        line = b''.join(json.dumps(event).encode() + b'\n' for event in events)
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(line)
+                except OSError:
+                    # Client went away
+                    client.close()
+                    self.clients.remove(client)
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        os.unlink(self.path)
+
+
+def is_empty(event):
+    return not event['sources'] if event['mode'] == 'multi' else event['azimuth'] is None
+
+
+class EventWriter:
+    """
+    Hands prediction events over to publishers on a background thread, so slow terminals,
+    pipes or sockets never hold up inference. publish only queues the event and can be
+    used as a predictor listener.
+
+    Events are written in batches, gathered for interval seconds. At most max_rate events
+    per second are written, the newest ones, and with coalesce only the first of consecutive
+    events without a prediction is, per source. The queue drops the oldest events when full,
+    unless drop_policy is 'block', which is only meant for replayed audio.
+    """
+
+    def __init__(self, publishers, interval=0.05, max_rate=None, coalesce=True, queue_size=1024,
+                 drop_policy='drop-oldest'):
+        self.publishers = publishers
+        self.interval = interval
+        self.max_rate = max_rate
+        self.coalesce = coalesce
+
+        self.frame_buffer = FrameBuffer(queue_size, drop_policy)
+        self.silent_sources = set()
+        self.allowance = max_rate
+        self.last_write = time.monotonic()
+        self.coalesced_events = 0
+        self.rate_limited_events = 0
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def failed(self):
+        return any(publisher.failed for publisher in self.publishers)
+
+    @property
+    def dropped_events(self):
+        return self.frame_buffer.dropped_frames
+
+    def publish(self, event):
+        self.frame_buffer.put(event)
+
+    def filter(self, events):
+        if self.coalesce:
+            kept = []
+            for event in events:
+                source = event.get('source')
+                if not is_empty(event):
+                    self.silent_sources.discard(source)
+                elif source not in self.silent_sources:
+                    self.silent_sources.add(source)
+                else:
+                    self.coalesced_events += 1
+                    continue
+                kept.append(event)
+            events = kept
+
+        if self.max_rate is not None:
+            now = time.monotonic()
+            self.allowance = min(self.max_rate, self.allowance + (now - self.last_write) * self.max_rate)
+            self.last_write = now
+            allowed = int(self.allowance)
+            if len(events) > allowed:
+                self.rate_limited_events += len(events) - allowed
+                events = events[len(events) - allowed:] if allowed else []
+            self.allowance -= len(events)
+
+        return events
+
+    def run(self):
+        while True:
+            event = self.frame_buffer.get()
+            if event is None:
+                return
+
+            # Let the events of the next interval gather, so they are written in one go
+            time.sleep(self.interval)
+            events = [event] + self.frame_buffer.get_pending(self.frame_buffer.size)
+            try:
+                batch = self.filter(events)
+                for publisher in self.publishers:
+                    if batch and not publisher.failed:
+                        publisher.publish_batch(batch)
+            except Exception:
+                # A failing publisher must not stop the others
+                traceback.print_exc()
+            finally:
+                self.frame_buffer.task_done(len(events))
+
+    def close(self):
+        """
+        Writes out every queued event and closes the publishers.
+        """
+        self.frame_buffer.join()
+        self.frame_buffer.close()
+        self.thread.join()
+        for publisher in self.publishers:
+            publisher.close()
+
+
+def create_publisher(output):
+    """
+    Creates a publisher from an output specification:
+    'stdout', 'console', 'unix:<socket path>' or 'udp:<host>:<port>'.
+    """
+    if output == 'stdout':
+        return StdoutPublisher()
+    elif output == 'console':
+        return ConsolePublisher()
+    elif output.startswith('unix:'):
+        return UnixSocketPublisher(output[len('unix:'):])
+    elif output.startswith('udp:'):
+        host, port = output[len('udp:'):].rsplit(':', 1)
+        return UdpPublisher(host, int(port))
+
+    raise ValueError(f'Unknown output {output!r}, expected stdout, console, unix:<path> or udp:<host>:<port>')
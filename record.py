@@ -1,34 +1,67 @@
-import pyaudio
-import sys
-import numpy as np
-from scipy.io import wavfile
-from utils import CHUNK, RATE, CHANNELS, FORMAT
+#!/usr/bin/python3
+"""
+Records multichannel audio from the microphone array straight to disk.
 
-LEN = int(sys.argv[1])
-recording_angle = sys.argv[2]
+Usage: python3 record.py <length in seconds, 0 until Ctrl+C> <angle> [--directory DIR] [--channels N ...]
+                         [--max-mb N] [--max-seconds N] [--device N]
+"""
+import argparse
+import os
+import signal
+from threading import Event
 
-print(f'Recording data for angle: {recording_angle} degrees.')
-print(f'Recording length will be {LEN} seconds.')
+from audio_source import PyAudioSource
+from recorder import Recorder
+from utils import *
 
-p = pyaudio.PyAudio()
-stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
 
-frames = []
+def main():
+    parser = argparse.ArgumentParser(description='Record the microphone array to a WAV file.')
+    parser.add_argument('length', type=float, help='recording length in seconds, 0 to record until Ctrl+C')
+    parser.add_argument('angle', help='source angle, used in the file name recording_angle_<angle>.wav')
+    parser.add_argument('--directory', default='../training_data', help='directory to write the recording to')
+    parser.add_argument('--channels', type=int, nargs='+', help=f'device channels to keep, all {CHANNELS} by default')
+    parser.add_argument('--max-mb', type=float, help='start a new file after this many megabytes')
+    parser.add_argument('--max-seconds', type=float, help='start a new file after this many seconds')
+    parser.add_argument('--device', type=int, help='PortAudio input device index')
+    args = parser.parse_args()
 
-for i in range(int(LEN * RATE / CHUNK)):
-    data = stream.read(CHUNK)
-    frames.append(data)
+    os.makedirs(args.directory, exist_ok=True)
+    path = os.path.join(args.directory, f'recording_angle_{args.angle}.wav')
+    max_bytes = int(args.max_mb * 1e6) if args.max_mb else None
+    recorder = Recorder(path, args.channels, max_bytes, args.max_seconds)
 
-stream.stop_stream()
-stream.close()
-p.terminate()
+    print(f'Recording data for angle: {args.angle} degrees.')
+    print(f'Recording length will be {args.length} seconds.' if args.length else 'Recording until Ctrl+C.')
 
-print('Saving data...')
+    stopped = Event()
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    samples = int(args.length * RATE)
 
-frames = np.frombuffer(b''.join(frames), dtype=np.int16)
-frames = np.reshape(frames, (-1, CHANNELS))
-all_data = frames[:, :CHANNELS - 1]
+    def callback(in_data, frame_count, time_info, status):
+        nonlocal samples
+        if args.length:
+            in_data = in_data[:min(frame_count, samples) * CHANNELS * 2]
+            samples -= frame_count
+        recorder.put(in_data)
+        if args.length and samples <= 0:
+            stopped.set()
+            return in_data, PA_COMPLETE
+        return in_data, PA_CONTINUE
 
-wavfile.write(f'../training_data/recording_angle_{recording_angle}.wav', RATE, all_data)
+    source = PyAudioSource(args.device)
+    source.start(callback)
+    while not stopped.wait(0.5):
+        pass
+    source.close()
 
-print('Done.')
+    print('Saving data...')
+    recorder.close()
+    if recorder.dropped_blocks:
+        print(f'{recorder.dropped_blocks} blocks were dropped, the disk could not keep up.')
+    print('Written ' + ', '.join(recorder.parts))
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
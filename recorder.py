@@ -0,0 +1,159 @@
+import os
+import struct
+import sys
+import time
+from threading import Thread
+
+from frame_buffer import FrameBuffer
+from utils import *
+
+# RIFF sizes are 32 bits, longer files are upgraded to RF64 (EBU Tech 3306)
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+
+class WavWriter:
+    """
+    Writes 16-bit PCM to a WAV file as it arrives. The header is patched with the current
+    length on every sync, so a crash only loses the blocks written since the last one.
+    A JUNK chunk reserves room for a ds64 chunk, so files over 4 GB become valid RF64 files.
+    """
+    HEADER_SIZE = 80
+
+    def __init__(self, path, channels, rate=RATE):
+        self.path = path
+        self.channels = channels
+        self.rate = rate
+        self.data_size = 0
+
+        self.file = open(path, 'wb')
+        self.write_header()
+
+    @property
+    def seconds(self):
+        return self.data_size / (2 * self.channels * self.rate)
+
+    def write_header(self):
+        block_align = 2 * self.channels
+        riff_size = self.HEADER_SIZE - 8 + self.data_size
+        rf64 = riff_size > MAX_RIFF_SIZE
+
+        header = b''.join([
+            b'RF64' if rf64 else b'RIFF', struct.pack('<I', MAX_RIFF_SIZE if rf64 else riff_size), b'WAVE',
+            b'ds64' if rf64 else b'JUNK', struct.pack('<I', 28),
+            struct.pack('<QQQI', riff_size, self.data_size, self.data_size // block_align, 0) if rf64 else bytes(28),
+            b'fmt ', struct.pack('<IHHIIHH', 16, 1, self.channels, self.rate, self.rate * block_align,
+                                 block_align, 16),
+            b'data', struct.pack('<I', MAX_RIFF_SIZE if rf64 else self.data_size),
+        ])
+
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.seek(0, os.SEEK_END)
+
+    def write(self, samples):
+        """
+        Appends int16 samples of shape (frames, channels).
+        """
+        data = np.ascontiguousarray(samples, dtype='<i2').tobytes()
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def sync(self):
+        self.write_header()
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
+
+
+class Recorder:
+    """
+    Records raw 8-channel blocks to WAV files on its own writer thread, so it can be fed
+    from an audio callback. Blocks are queued and dropped, never waited for, if the disk
+    cannot keep up.
+
+    Args:
+        path: WAV file to write, with rotation a number is added to the name of every part
+        channels: device channels to keep, all 8 by default
+        max_bytes: start a new file once the audio data reaches this size
+        max_seconds: start a new file once the recording reaches this length
+        sync_interval: seconds between header updates
+    """
+
+    def __init__(self, path, channels=None, max_bytes=None, max_seconds=None, sync_interval=1.0,
+                 queue_size=64):
+        self.path = path
+        self.channels = list(range(CHANNELS)) if channels is None else list(channels)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.sync_interval = sync_interval
+
+        self.frame_buffer = FrameBuffer(queue_size, 'drop-newest')
+        self.writer = None
+        self.parts = []
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def dropped_blocks(self):
+        return self.frame_buffer.dropped_frames
+
+    def put(self, in_data):
+        """
+        Queues a raw block of the device stream, without blocking. Can be used as a predictor tap.
+        """
+        self.frame_buffer.put(in_data)
+
+    def get_part_path(self):
+        if self.max_bytes is None and self.max_seconds is None:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f'{root}_{len(self.parts):03d}{ext}'
+
+    def needs_rotation(self):
+        return (self.max_bytes is not None and self.writer.data_size >= self.max_bytes) or \
+            (self.max_seconds is not None and self.writer.seconds >= self.max_seconds)
+
+    def open_part(self):
+        if self.writer is not None:
+            self.writer.close()
+        path = self.get_part_path()
+        self.writer = WavWriter(path, len(self.channels))
+        self.parts.append(path)
+
+    def run(self):
+        last_sync = time.monotonic()
+        while True:
+            in_data = self.frame_buffer.get()
+            if in_data is None:
+                return
+
+            try:
+                if self.writer is None or self.needs_rotation():
+                    self.open_part()
+
+                data = np.frombuffer(in_data, dtype=np.int16).reshape(-1, CHANNELS)
+                self.writer.write(data[:, self.channels])
+
+                if time.monotonic() - last_sync >= self.sync_interval:
+                    self.writer.sync()
+                    last_sync = time.monotonic()
+            except OSError as e:
+                print(f'Recording failed: {e}', file=sys.stderr)
+                self.frame_buffer.close()
+            finally:
+                self.frame_buffer.task_done()
+
+    def close(self):
+        """
+        Writes out every queued block and finalizes the current file.
+        """
+        self.frame_buffer.join()
+        self.frame_buffer.close()
+        self.thread.join()
+        if self.writer is not None:
+            self.writer.close()
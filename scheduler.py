@@ -0,0 +1,91 @@
+from threading import Condition, Thread
+
+
+class Scheduler:
+    """
+    Runs the inference of several predictors, one per microphone array, on a small pool of worker threads.
+
+    Every predictor is served by at most one worker at a time, which processes at most one batch
+    of its queued frames per turn. Workers take the predictors with queued frames in round-robin
+    order, so a busy array cannot starve the others. With more than one worker, a slow array only
+    holds up its own worker, and each predictor loads its own copy of the models
+    (see Predictor.get_model_instance), as interpreters must not be invoked from several threads
+    at once. With a single worker, the arrays take turns on one thread and share their interpreters.
+    Every predictor keeps its own capture stream, frame buffer, gate and tracker.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.predictors = []
+        # Predictors a worker is running a turn of
+        self.busy = set()
+        self.next_index = 0
+        self.condition = Condition()
+        self.stopped = False
+
+        self.threads = [Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, predictor):
+        with self.condition:
+            self.predictors.append(predictor)
+            self.condition.notify_all()
+
+    def remove(self, predictor):
+        """
+        Stops serving a predictor. If its turn is running, waits until it is over,
+        so the predictor can be closed once this returns.
+        """
+        with self.condition:
+            if predictor in self.predictors:
+                self.predictors.remove(predictor)
+            while predictor in self.busy:
+                self.condition.wait()
+
+    def notify(self):
+        """
+        Wakes a worker up, called from the audio callbacks after queueing a block.
+        """
+        with self.condition:
+            self.condition.notify()
+
+    def get_next(self):
+        # Next predictor in round-robin order with queued frames that no other worker is serving
+        n = len(self.predictors)
+        for i in range(n):
+            predictor = self.predictors[(self.next_index + i) % n]
+            if predictor not in self.busy and predictor.backlog:
+                self.next_index = (self.next_index + i + 1) % n
+                self.busy.add(predictor)
+                return predictor
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                predictor = self.get_next()
+                while predictor is None and not self.stopped:
+                    self.condition.wait()
+                    predictor = self.get_next()
+                if self.stopped:
+                    if predictor is not None:
+                        self.busy.discard(predictor)
+                    return
+
+            try:
+                frames = predictor.frame_buffer.get_pending(predictor.max_batch)
+                if frames:
+                    predictor.process_blocks(frames)
+            finally:
+                # Frames of this predictor skipped while it was busy can be taken by any worker now
+                with self.condition:
+                    self.busy.discard(predictor)
+                    self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
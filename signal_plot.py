@@ -0,0 +1,100 @@
+import time
+
+from utils import *
+
+
+def min_max_envelope(samples, n_bins):
+    """
+    Reduces every channel to the minimum and maximum of n_bins equal spans, which draws the same
+    as the full signal at a width of n_bins pixels with a fraction of the points.
+
+    Returns:
+        Sample positions and values, of shapes (2 * n_bins,) and (2 * n_bins, channels),
+        or all samples if there are not more than that
+    """
+    # Narrower than the envelope would be, the signal itself is drawn
+    if len(samples) <= 2 * n_bins:
+        return np.arange(len(samples)), samples
+
+    span = len(samples) // n_bins
+    n_bins = len(samples) // span
+    spans = samples[:n_bins * span].reshape(n_bins, span, -1)
+
+    envelope = np.empty((n_bins, 2, spans.shape[2]), dtype=samples.dtype)
+    np.min(spans, axis=1, out=envelope[:, 0])
+    np.max(spans, axis=1, out=envelope[:, 1])
+    x = np.repeat(np.arange(n_bins) * span + span // 2, 2)
+    return x, envelope.reshape(2 * n_bins, -1)
+
+
+class SignalPlot:
+    """
+    Live plot of the microphone signals, one line per channel, cheap enough to leave open next to inference.
+
+    Every channel is reduced to a min/max envelope as wide as its axes in pixels. Only the lines are
+    redrawn, over a cached background of the figure that is captured again after every full draw,
+    e.g. on resize. Redraws happen at most max_fps times per second and only after new samples arrived.
+    """
+
+    def __init__(self, fig, lines, max_fps=15):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.lines = lines
+        self.interval = 1 / max_fps
+
+        self.samples = None
+        self.version = 0
+        self.drawn_version = 0
+        self.last_draw = 0.0
+
+        # Blitting draws the lines separately from the rest of the figure
+        self.blit = getattr(self.canvas, 'supports_blit', False)
+        self.background = None
+        if self.blit:
+            for line in lines:
+                line.set_animated(True)
+            self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        # The full draw left the animated lines out
+        self.drawn_version = -1
+
+    def update(self, samples):
+        """
+        Hands over the latest samples of shape (samples, channels), drawn by the next draw call.
+        """
+        self.samples = samples
+        self.version += 1
+
+    def draw(self):
+        """
+        Redraws the lines if there are new samples and the last redraw is long enough ago.
+
+        Returns:
+            True if the plot was redrawn
+        """
+        now = time.perf_counter()
+        if self.samples is None or self.version == self.drawn_version or now - self.last_draw < self.interval:
+            return False
+        self.drawn_version = self.version
+        self.last_draw = now
+
+        width = max(1, int(self.lines[0].axes.bbox.width))
+        x, envelope = min_max_envelope(self.samples, width)
+        for c, line in enumerate(self.lines):
+            line.set_data(x, envelope[:, c])
+
+        if not self.blit:
+            self.canvas.draw_idle()
+        elif self.background is None:
+            # The first full draw captures the background, the lines follow on the next call
+            self.canvas.draw()
+            self.drawn_version = -1
+        else:
+            self.canvas.restore_region(self.background)
+            for line in self.lines:
+                line.axes.draw_artist(line)
+            self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+        return True
@@ -8,44 +8,23 @@ from doa_app import DoaApp
 from utils import UI_RESOLUTION
 
 
+def format_stage_time(predictor, stage):
+    histogram = predictor.stage_times[stage]
+    if not histogram.count:
+        return 'N/A'
+    return f'{round(histogram.mean * 1000, 1)} (p95 {round(histogram.quantile(0.95) * 1000, 1)})'
+
+
 def print_statistics(predictor):
-    cnn_inference_time = round(np.mean(predictor.cnn_exec_times) * 1000, 1) \
-        if predictor.cnn_exec_times else 'N/A'
-    music_inference_time = round(np.mean(predictor.music_exec_times) * 1000, 1) \
-        if predictor.music_exec_times else 'N/A'
     print(f'Application closed.')
-    print(f'Average CNN inference time (ms): {cnn_inference_time}')
-    print(f'Average MUSIC inference time (ms): {music_inference_time}')
+    print(f'Average CNN inference time (ms): {format_stage_time(predictor, "azimuth")}')
+    print(f'Average MUSIC inference time (ms): {format_stage_time(predictor, "music")}')
+    print(f'Frames dropped by the inference worker: {predictor.dropped_frames}')
+    print(f'Input overflows: {predictor.input_overflows}')
+    print(f'Frames skipped by the activity gate: {predictor.skipped_frames} of {predictor.gate.frames}')
 
 
 class SingleSourceApp(DoaApp):
-    def color_arcs(self, C, confs, max_idx):
-        arcs = []
-        for i, conf in enumerate(confs):
-            # Color the fraction of arc area proportional to probability
-            R = self.RADIUS * conf ** 0.5
-
-            x_1 = y_1 = self.DIM / 2 - R
-
-            coord = x_1, y_1, x_1 + 2 * R, y_1 + 2 * R
-
-            if i == max_idx:
-                fill = '#78ebb3'
-                outline = '#2ca86b'
-            else:
-                fill = '#ffadad'
-                outline = '#db6b6b'
-
-            arc = C.create_arc(coord, start=i * UI_RESOLUTION - 5,
-                               extent=UI_RESOLUTION, fill=fill, outline=outline, width=2)
-            arcs.append(arc)
-
-        self.top.update()
-
-        # Delete all arcs to draw them again at next iteration
-        for arc in arcs:
-            C.delete(arc)
-
     def create_title_label(self):
         super().create_title_label()
         label = Label(self.data_frame, text="Single source")
@@ -81,50 +60,47 @@ class SingleSourceApp(DoaApp):
         Hovertip(music_button, 'Estimate azimuth angle with \nMUSIC algorithm.')
         return CNN
 
-    def run(self):
-        C = self.create_canvas()
-        az_label, az_val, az_conf_label, az_conf_val, el_label, el_val, el_conf_label, el_conf_val = self.create_labels()
-        CNN = self.create_radio_buttons()
-
-        predictor = self.get_predictor('single', tpu=self.tpu)
-        if not predictor:
-            return
-
-        while True:
-            predictor.is_active = self.prediction_running
-            predictor.CNN = CNN.get()
-
-            # Get probabilities from model
-            all_confs = np.roll(predictor.az_confidences, UI_RESOLUTION // 2)
-            display_confs = [max(group) for group in np.split(all_confs, 360 // UI_RESOLUTION)]
-
-            # Normalize confidences to sum to 1
-            total = sum(display_confs)
-            if total:
-                display_confs /= total
-            max_idx = np.argmax(display_confs)
-
-            # Color arcs based on model probabilities
-            try:
-                self.color_arcs(C, display_confs, max_idx)
-            except TclError:
-                predictor.is_active = False
-                print_statistics(predictor)
-                return
-
-            az_prediction = predictor.az_current_prediction
-            el_prediction = predictor.el_current_prediction
-
-            if not (az_prediction is None or el_prediction is None):
-                (pred, conf), (el_pred, el_conf) = az_prediction, el_prediction
-                conf = f'{round(conf * 100, 1)}%' if CNN.get() else 'N/A'
-                el_conf = f'{round(el_conf * 100, 1)}%'
-                az_val.config(text=f'{pred}\N{DEGREE SIGN}')
-                az_conf_val.config(text=conf)
-                el_val.config(text=f'{el_pred}\N{DEGREE SIGN}')
-                el_conf_val.config(text=el_conf)
-            else:
-                az_val.config(text='-')
-                az_conf_val.config(text='-')
-                el_val.config(text='-')
-                el_conf_val.config(text='-')
+    def create_widgets(self):
+        self.az_label, self.az_val, self.az_conf_label, self.az_conf_val, \
+            self.el_label, self.el_val, self.el_conf_label, self.el_conf_val = self.create_labels()
+        self.CNN = self.create_radio_buttons()
+
+        return self.get_predictor('single', tpu=self.tpu)
+
+    def update_view(self):
+        predictor = self.predictor
+        predictor.is_active = self.prediction_running
+        predictor.CNN = self.CNN.get()
+
+        # Get probabilities from model
+        all_confs = np.roll(predictor.az_confidences, UI_RESOLUTION // 2)
+        display_confs = [max(group) for group in np.split(all_confs, 360 // UI_RESOLUTION)]
+
+        # Normalize confidences to sum to 1
+        total = sum(display_confs)
+        if total:
+            display_confs /= total
+        max_idx = np.argmax(display_confs)
+
+        # Color arcs based on model probabilities
+        self.renderer.draw(display_confs, lambda i: i == max_idx)
+
+        az_prediction = predictor.az_current_prediction
+        el_prediction = predictor.el_current_prediction
+
+        if not (az_prediction is None or el_prediction is None):
+            (pred, conf), (el_pred, el_conf) = az_prediction, el_prediction
+            conf = f'{round(conf * 100, 1)}%' if self.CNN.get() else 'N/A'
+            el_conf = f'{round(el_conf * 100, 1)}%'
+            self.az_val.config(text=f'{pred}\N{DEGREE SIGN}')
+            self.az_conf_val.config(text=conf)
+            self.el_val.config(text=f'{el_pred}\N{DEGREE SIGN}')
+            self.el_conf_val.config(text=el_conf)
+        else:
+            self.az_val.config(text='-')
+            self.az_conf_val.config(text='-')
+            self.el_val.config(text='-')
+            self.el_conf_val.config(text='-')
+
+    def on_close(self, predictor):
+        print_statistics(predictor)
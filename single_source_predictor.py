@@ -1,121 +1,154 @@
-import os
-import pathlib
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-import tflite_runtime.interpreter as tflite
-
-from predictor import Predictor, get_mic_data, get_input_matrix, get_model_details
+from model_registry import load_model
+from music import MusicEngine
+from predictor import Predictor, get_input_matrix, invoke_batch
 from utils import *
-from pyroomacoustics.doa import MUSIC
-from pyroomacoustics import circular_2D_array
 
 
-def init_models(tpu):
+def read_elevation_output(el_output_data):
+    # Get the predicted elevation as argument of the max probability
+    el_prediction, el_confidence = np.argmax(el_output_data) * ELEVATION_RESOLUTION, np.max(el_output_data)
+    return el_prediction, el_confidence
+
+
+def init_models(tpu, num_threads=None, instance=None):
     print('Loading models...')
-    # Load the TFLite model and allocate tensors.
-    base_dir = pathlib.Path(__file__).parent.absolute()
+    # Get allocated TFLite interpreters, only loaded the first time they are used
     if tpu:
-        az_model_file = os.path.join(base_dir, 'models', 'quant_input_model_edgetpu.tflite')
-        az_interpreter = tflite.Interpreter(model_path=az_model_file,
-                                            experimental_delegates=[tflite.load_delegate('libedgetpu.so.1')])
+        az_interpreter, az_input_details, az_output_details = load_model(
+            'quant_input_model_edgetpu', delegate='libedgetpu.so.1', num_threads=num_threads, instance=instance)
     else:
-        az_model_file = os.path.join(base_dir, 'models', 'best_super_azimuth_model.tflite')
-        az_interpreter = tflite.Interpreter(model_path=az_model_file)
+        az_interpreter, az_input_details, az_output_details = load_model(
+            'best_super_azimuth_model', num_threads=num_threads, instance=instance)
 
-    el_model_file = os.path.join(base_dir, 'models', 'elevation_model.tflite')
-    el_interpreter = tflite.Interpreter(model_path=el_model_file)
+    el_interpreter, el_input_details, el_output_details = load_model('elevation_model', num_threads=num_threads,
+                                                                     instance=instance)
 
-    print('Allocating tensors...')
-    az_interpreter.allocate_tensors()
-    el_interpreter.allocate_tensors()
-    print('Tensors allocated.\n')
-
-    # Get input and output tensors for both models
-    az_input_details, az_input_shape, az_output_details, az_output_shape = get_model_details(az_interpreter)
-    el_input_details, el_input_shape, el_output_details, el_output_shape = get_model_details(el_interpreter)
-
-    print('Azimuth model input tensor: ' + str(az_input_shape))
-    print('Azimuth model output tensor: ' + str(az_output_shape))
-    print('Elevation model input tensor: ' + str(el_input_shape))
-    print('Elevation model output tensor: ' + str(el_output_shape))
+    print('Azimuth model input tensor: ' + str(az_input_details['shape']))
+    print('Azimuth model output tensor: ' + str(az_output_details['shape']))
+    print('Elevation model input tensor: ' + str(el_input_details['shape']))
+    print('Elevation model output tensor: ' + str(el_output_details['shape']))
     print('\nModels ready. Press Start to begin inference.\n')
 
     return az_interpreter, az_input_details, az_output_details, el_interpreter, el_input_details, el_output_details
 
 
 class SingleSourcePredictor(Predictor):
-    def __init__(self, lines, fig, thresh=50, max_silence_frames=10, tpu=False):
-        super().__init__(lines, fig, thresh, max_silence_frames)
+    def __init__(self, lines, fig, thresh=50, max_silence_frames=10, tpu=False, autostart=True,
+                 music_coarse_step=1, num_threads=None, parallel=False, **kwargs):
+        super().__init__(lines, fig, thresh, max_silence_frames, **kwargs)
         self.az_current_prediction = None
         self.el_current_prediction = None
         self.az_confidences = np.zeros(360 // AZIMUTH_RESOLUTION)
         self.CNN = True
 
-        self.stream = self.p.open(
-            format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-            frames_per_buffer=CHUNK, stream_callback=self.callback
-        )
-
-        self.cnn_exec_times = []
-        self.music_exec_times = []
+        # Built once, so MUSIC frames only pay for the covariance and the grid search
+        self.music = MusicEngine(coarse_step=music_coarse_step)
 
-        self.stream.start_stream()
         self.az_interpreter, self.az_input_details, self.az_output_details, \
-            self.el_interpreter, self.el_input_details, self.el_output_details = init_models(tpu)
+            self.el_interpreter, self.el_input_details, self.el_output_details = init_models(
+                tpu, num_threads, self.get_model_instance())
 
-    def callback(self, in_data, frame_count, time_info, status):
-        data, mic_data = get_mic_data(in_data)
+        # Quantization of the Edge TPU model, folded into writing its input tensor
+        self.az_quantized = self.az_input_details['dtype'] == np.uint8
+        input_scale, self.az_input_zero_point = self.az_input_details['quantization']
+        self.az_input_inv_scale = np.float32(1 / input_scale) if self.az_quantized else None
+        self.az_output_scale = np.float32(self.az_output_details['quantization'][0])
+        self.az_scaled_input = np.empty(self.el_input_details['shape'], dtype=np.float32)
 
-        if self.is_active:
-            self.mic_data = mic_data
+        # Confidences of the last single frame prediction, copied out of the output tensor
+        self.az_output_data = np.empty(self.az_output_details['shape'][1:], dtype=np.float32)
 
-        if abs(np.max(mic_data)) > self.thresh and self.is_active:
-            input_data = get_input_matrix(mic_data)
-            if self.CNN:
-                self.az_current_prediction = self.get_azimuth_prediction(input_data)
-            else:
-                self.az_current_prediction = self.run_music(mic_data)
-            self.el_current_prediction = self.get_elevation_prediction(input_data)
-        else:
-            if self.silent_frames == self.max_silence_frames:
-                self.silent_frames = 0
-                self.az_current_prediction = None
-                self.az_confidences = np.zeros(360 // AZIMUTH_RESOLUTION)
-                self.el_current_prediction = None
-            self.silent_frames += 1
-        if self.is_active:
-            self.output_predictions()
+        # With parallel, the elevation model runs on a thread of its own while the worker runs the azimuth
+        # model or MUSIC, so a frame takes as long as the slower of the two instead of both together.
+        # TFLite releases the GIL while invoking, the two interpreters are never invoked from two threads at once
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='elevation') if parallel else None
+
+        if autostart:
+            self.start()
 
-        return data, pyaudio.paContinue
+    def set_prediction(self, prediction):
+        if prediction is not None:
+            self.az_current_prediction, self.el_current_prediction = prediction
+            return [self.az_current_prediction]
+
+        if self.az_current_prediction is not None:
+            self.az_current_prediction = None
+            self.az_confidences = np.zeros(360 // AZIMUTH_RESOLUTION)
+            self.el_current_prediction = None
+        return []
+
+    def update_tracks(self, measurements):
+        """
+        Replaces the azimuth prediction with the tracked azimuth, extrapolated if there are no measurements.
+        """
+        tracks = self.tracker.step(measurements)
+        if tracks:
+            self.az_current_prediction = round(tracks[0].azimuth) % 360, tracks[0].confidence
+
+    def predict_frame(self, mic_data, spectra=None):
+        """
+        Runs the azimuth CNN, or MUSIC, and the elevation CNN on a single frame, concurrently with parallel.
+
+        Returns:
+            ((azimuth, confidence), (elevation, confidence))
+        """
+        self.write_model_inputs(mic_data, spectra)
+        get_azimuth = self.get_azimuth_prediction if self.CNN else partial(self.run_music, mic_data)
+        if self.executor is None:
+            return get_azimuth(), self.get_elevation_prediction()
+
+        elevation = self.executor.submit(self.get_elevation_prediction)
+        return get_azimuth(), elevation.result()
 
     def run_music(self, mic_data):
-        start_time = time.time()
+        start_time = time.perf_counter()
         stft_data = compute_stft_matrix(mic_data)
         az_current_prediction = self.get_music_prediction(stft_data)
-        self.music_exec_times.append(time.time() - start_time)
+        self.observe('music', time.perf_counter() - start_time)
         return az_current_prediction
 
-    def get_azimuth_prediction(self, input_data):
-        # Set input and run azimuth interpreter
-        if len(self.az_input_details['shape']) == 4:
-            input_data = input_data[..., np.newaxis]
+    def write_model_inputs(self, mic_data, spectra=None):
+        """
+        Computes the GCC matrix of a frame straight into the input tensor of the elevation model
+        and copies it to the input tensor of the azimuth model, quantizing it on the way if needed.
+        Tensor views are taken anew every frame, TFLite refuses to invoke while they are alive.
+        """
+        start_time = time.perf_counter()
+        el_input = self.el_interpreter.tensor(self.el_input_details['index'])()
+        az_input = self.az_interpreter.tensor(self.az_input_details['index'])().reshape(el_input.shape)
+
+        get_input_matrix(mic_data, el_input, self.gcc_workspace, spectra)
+        if self.az_quantized:
+            np.multiply(el_input, self.az_input_inv_scale, out=self.az_scaled_input)
+            np.add(self.az_scaled_input, self.az_input_zero_point, out=az_input, casting='unsafe')
+        else:
+            az_input[:] = el_input
+        self.observe('gcc', time.perf_counter() - start_time)
 
-        if self.az_input_details['dtype'] == np.uint8:
-            input_scale, input_zero_point = self.az_input_details["quantization"]
-            input_data = input_data / input_scale + input_zero_point
+    def prepare_azimuth_input(self, input_data):
+        """
+        Converts a batch of input matrices to the layout and dtype of the azimuth model.
+        """
+        input_data = input_data.reshape((len(input_data), *self.az_input_details['shape'][1:]))
 
-        start_time = time.time()
-        self.az_interpreter.set_tensor(self.az_input_details['index'],
-                                       input_data.astype(self.az_input_details['dtype']))
-        self.az_interpreter.invoke()
+        if self.az_quantized:
+            input_data = (input_data * self.az_input_inv_scale + self.az_input_zero_point).astype(np.uint8)
 
-        az_output_data = self.az_interpreter.get_tensor(self.az_output_details['index'])[0]
-        execution_time = time.time() - start_time
-        self.cnn_exec_times.append(execution_time)
+        return input_data
 
+    def read_azimuth_output(self, az_output_data, out=None):
+        """
+        Dequantizes the azimuth model output into out if given and makes it the current confidences.
+        """
         if self.az_output_details['dtype'] == np.uint8:
-            output_scale, _ = self.az_output_details["quantization"]
-            az_output_data = az_output_data * output_scale
+            az_output_data = np.multiply(az_output_data, self.az_output_scale, out=out, dtype=np.float32)
+        elif out is not None:
+            out[:] = az_output_data
+            az_output_data = out
 
         self.az_confidences = az_output_data
 
@@ -123,43 +156,91 @@ class SingleSourcePredictor(Predictor):
         az_prediction, az_confidence = np.argmax(self.az_confidences) * AZIMUTH_RESOLUTION, np.max(self.az_confidences)
         return az_prediction, az_confidence
 
-    def get_music_prediction(self, input_data):
-        mic_center = [2, 2]
-        mic_height = 1
-
-        # Radius constant, will always be the same for MiniDSP array
-        mic_radius = 0.045
-        R = circular_2D_array(center=mic_center, M=6, phi0=0, radius=mic_radius)
-        R = np.vstack((R, [mic_height] * 6))
+    def get_azimuth_prediction(self):
+        # Run azimuth interpreter on the input written by write_model_inputs
+        start_time = time.perf_counter()
+        self.az_interpreter.invoke()
 
-        # Run MUSIC algorithm for DOA
-        doa = MUSIC(R, RATE, 256, n_grid=(360 // AZIMUTH_RESOLUTION))
-        doa.locate_sources(input_data)
+        az_output_data = self.az_interpreter.tensor(self.az_output_details['index'])()[0]
+        self.observe('azimuth', time.perf_counter() - start_time)
 
-        prediction = round((doa.azimuth_recon[0] * 180 / math.pi))
-        self.az_confidences = np.zeros(360 // AZIMUTH_RESOLUTION)
-        self.az_confidences[prediction] = 1
+        return self.read_azimuth_output(az_output_data, self.az_output_data)
 
-        return round((doa.azimuth_recon[0] * 180 / math.pi)), 1
+    def get_azimuth_predictions(self, input_batch):
+        """
+        Batched version of get_azimuth_prediction, running the model once for all frames.
+        """
+        start_time = time.perf_counter()
+        az_output_batch = invoke_batch(self.az_interpreter, self.az_input_details, self.az_output_details,
+                                       self.prepare_azimuth_input(input_batch))
+        self.observe('azimuth', (time.perf_counter() - start_time) / len(input_batch), len(input_batch))
 
-    def get_elevation_prediction(self, input_data):
-        # Set input and run elevation interpreter
-        self.el_interpreter.set_tensor(self.el_input_details['index'], input_data)
-        self.el_interpreter.invoke()
-        el_output_data = self.el_interpreter.get_tensor(self.el_output_details['index'])
+        return [self.read_azimuth_output(az_output_data) for az_output_data in az_output_batch]
 
-        # Get the predicted elevation as argument of the max probability
-        el_prediction, el_confidence = np.argmax(el_output_data[0]) * ELEVATION_RESOLUTION, np.max(el_output_data[0])
+    def get_music_prediction(self, input_data):
+        prediction = self.music.locate_source(input_data)
+        self.az_confidences = np.zeros(360 // AZIMUTH_RESOLUTION)
+        self.az_confidences[prediction // AZIMUTH_RESOLUTION] = 1
 
-        return el_prediction, el_confidence
+        return prediction, 1
 
-    def output_predictions(self):
+    def get_elevation_prediction(self):
+        # Run elevation interpreter on the input written by write_model_inputs
+        start_time = time.perf_counter()
+        self.el_interpreter.invoke()
+        el_output_data = self.el_interpreter.tensor(self.el_output_details['index'])()
+        self.observe('elevation', time.perf_counter() - start_time)
+
+        return read_elevation_output(el_output_data[0])
+
+    def get_elevation_predictions(self, input_batch):
+        """
+        Batched version of get_elevation_prediction, running the model once for all frames.
+        """
+        start_time = time.perf_counter()
+        el_output_batch = invoke_batch(self.el_interpreter, self.el_input_details, self.el_output_details,
+                                       input_batch)
+        self.observe('elevation', (time.perf_counter() - start_time) / len(input_batch), len(input_batch))
+        return [read_elevation_output(el_output_data) for el_output_data in el_output_batch]
+
+    def predict_batch(self, mic_frames, spectra=None):
+        """
+        Runs the CNNs on several frames at once, for offline processing or catching up.
+        MUSIC has no batched version, its frames are located one by one.
+
+        Returns:
+            ((azimuth, confidence), (elevation, confidence)) for every frame
+        """
+        if not self.CNN:
+            spectra = spectra if spectra is not None else [None] * len(mic_frames)
+            return [self.predict_frame(mic_data, X) for mic_data, X in zip(mic_frames, spectra)]
+        return self.predict_inputs(self.get_input_batch(mic_frames, spectra))
+
+    def predict_inputs(self, input_batch):
+        """
+        Runs the CNNs on a batch of input matrices that are already computed, such as cached features.
+
+        Returns:
+            ((azimuth, confidence), (elevation, confidence)) for every input
+        """
+        if self.executor is None:
+            return list(zip(self.get_azimuth_predictions(input_batch), self.get_elevation_predictions(input_batch)))
+
+        el_predictions = self.executor.submit(self.get_elevation_predictions, input_batch)
+        return list(zip(self.get_azimuth_predictions(input_batch), el_predictions.result()))
+
+    def close(self):
+        super().close()
+        # Closing waits for the worker or the scheduler turn that may be processing a frame,
+        # so no frame can use the pool after it is shut down
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def get_prediction_event(self):
+        event = {'timestamp': time.time(), 'frame': self.frame_index, 'mode': 'single',
+                 'azimuth': None, 'azimuth_confidence': None, 'elevation': None, 'elevation_confidence': None}
         if self.az_current_prediction is not None:
-            az_pred, az_conf = self.az_current_prediction
-            el_pred, el_conf = self.el_current_prediction
-            az_conf = round(az_conf * 100, 1)
-            el_conf = round(el_conf * 100, 1)
-            print('Azimuth: {:>3} degrees [{:>5}%]'.format(az_pred, az_conf), end=' | ')
-            print('Elevation: {:>3} degrees [{:>5}%]'.format(el_pred, el_conf))
-        else:
-            print('{:<63}'.format('[No prediction]'))
+            (az_pred, az_conf), (el_pred, el_conf) = self.az_current_prediction, self.el_current_prediction
+            event.update(azimuth=int(az_pred), azimuth_confidence=float(az_conf),
+                         elevation=int(el_pred), elevation_confidence=float(el_conf))
+        return event
@@ -0,0 +1,53 @@
+from utils import *
+
+
+class SlidingWindow:
+    """
+    Rolling analysis window over the last CHUNK samples of the 6 microphone channels,
+    advanced every hop samples, so predictions can be made more often than once per CHUNK.
+
+    Samples are kept in a buffer of twice the window length, where every block is written
+    both at its position in the first half and in the second half, so the window is always
+    a contiguous view and nothing has to be shifted or allocated when a block arrives.
+
+    Each window is transformed as a whole, which costs one multi-channel FFT per hop regardless
+    of the overlap. Caching the spectra of overlapping blocks and phase-shifting them into place
+    was measured to be slower, as every new block still needs an FFT of the full GCC length.
+    """
+
+    def __init__(self, hop=CHUNK, length=CHUNK, channels=CHANNELS - 2):
+        if hop <= 0 or length % hop:
+            raise ValueError(f'Window length {length} must be a multiple of the hop size {hop}')
+
+        self.hop = hop
+        self.length = length
+        self.buffer = np.zeros((2 * length, channels), dtype=np.float32)
+        self.position = 0
+        self.blocks_received = 0
+
+    @property
+    def samples(self):
+        """
+        View of the current window, overwritten by the next push.
+        """
+        start = self.position or self.length
+        return self.buffer[start:start + self.length]
+
+    def push(self, block):
+        """
+        Adds the next hop samples of raw 8-channel device data to the window,
+        picking and converting the microphone channels while copying.
+
+        Returns:
+            True once the window holds a full CHUNK of samples
+        """
+        start = self.position
+        block_samples = self.buffer[start + self.length:start + self.length + self.hop]
+        select_mic_channels(block, out=block_samples)
+        # Samples at the start of the first half are never part of a window
+        if start:
+            self.buffer[start:start + self.hop] = block_samples
+
+        self.position = (start + self.hop) % self.length
+        self.blocks_received += 1
+        return self.blocks_received * self.hop >= self.length
@@ -0,0 +1,47 @@
+import numpy as np
+
+from gate import ActivityGate
+from utils import CHANNELS, CHUNK, RATE
+
+
+def noise(rng, level):
+    return rng.normal(0, level, (CHUNK, CHANNELS - 2)).astype(np.float32)
+
+
+def burst(rng, level):
+    t = np.arange(CHUNK) / RATE
+    return noise(rng, 5) + (level * np.sin(2 * np.pi * 1000 * t))[:, None].astype(np.float32)
+
+
+def test_steady_noise_after_quiet_start_closes_gate():
+    rng = np.random.default_rng(0)
+    gate = ActivityGate(noise_window=50)
+    for _ in range(20):
+        gate.update(noise(rng, 5))
+
+    runs = [gate.update(noise(rng, 200)) for _ in range(500)]
+
+    # Active until the quiet frames have left the window, background afterwards
+    assert any(runs[:50])
+    assert not any(runs[60:])
+    assert not gate.is_open
+
+
+def test_steady_noise_at_startup_is_background():
+    rng = np.random.default_rng(1)
+    gate = ActivityGate()
+    runs = [gate.update(noise(rng, 200)) for _ in range(500)]
+
+    assert not any(runs)
+
+
+def test_sound_with_pauses_stays_detected():
+    rng = np.random.default_rng(2)
+    gate = ActivityGate(noise_window=50)
+    runs = []
+    for i in range(500):
+        # Bursts of 8 frames with a pause of 2 frames, for far longer than the window
+        frame = burst(rng, 300) if i % 10 < 8 else noise(rng, 5)
+        runs.append(gate.update(frame))
+
+    assert all(run for i, run in enumerate(runs) if i >= 10 and i % 10 < 8)
@@ -0,0 +1,140 @@
+from utils import *
+
+
+def wrap_angle(angle):
+    """
+    Wraps an angle difference in degrees to [-180, 180).
+    """
+    return (angle + 180) % 360 - 180
+
+
+class AzimuthTrack:
+    """
+    Constant velocity Kalman filter on the circle, with the azimuth in degrees
+    and its change per frame as state. Innovations are wrapped, so a source moving
+    through 0 degrees is tracked without a jump.
+    """
+
+    def __init__(self, azimuth, confidence, measurement_std=5.0, process_std=1.0, velocity_std=10.0):
+        self.x = np.array([azimuth % 360, 0.0])
+        self.P = np.diag([measurement_std ** 2, velocity_std ** 2])
+        self.F = np.array([[1.0, 1.0], [0.0, 1.0]])
+        self.Q = process_std ** 2 * np.array([[0.25, 0.5], [0.5, 1.0]])
+        self.R = measurement_std ** 2
+
+        self.confidence = confidence
+        self.hits = 1
+        self.misses = 0
+
+    @property
+    def azimuth(self):
+        return self.x[0]
+
+    @property
+    def std(self):
+        """
+        Standard deviation of the azimuth estimate in degrees.
+        """
+        return math.sqrt(self.P[0, 0])
+
+    def predict(self):
+        self.x = self.F @ self.x
+        self.x[0] %= 360
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def update(self, azimuth, confidence):
+        innovation = wrap_angle(azimuth - self.x[0])
+        K = self.P[:, 0] / (self.P[0, 0] + self.R)
+        self.x += K * innovation
+        self.x[0] %= 360
+        self.P -= np.outer(K, self.P[0])
+
+        self.confidence = confidence
+        self.hits += 1
+        self.misses = 0
+
+
+class DoaTracker:
+    """
+    Keeps up to max_tracks azimuth tracks across frames. Measurements are assigned to the
+    nearest track within gate degrees, the remaining ones start new tracks while there is room.
+    A track is reported once it has been measured birth_hits times and dropped after
+    max_misses frames with measurements that did not match it. Measurements within gate
+    degrees of a more confident one are taken as the same source.
+    """
+
+    def __init__(self, max_tracks=1, gate=30.0, birth_hits=1, max_misses=3, measurement_std=5.0,
+                 process_std=1.0):
+        self.max_tracks = max_tracks
+        self.gate = gate
+        self.birth_hits = birth_hits
+        self.max_misses = max_misses
+        self.measurement_std = measurement_std
+        self.process_std = process_std
+        self.tracks = []
+
+    @property
+    def confirmed_tracks(self):
+        return [track for track in self.tracks if track.hits >= self.birth_hits]
+
+    def uncertainty(self):
+        """
+        Largest azimuth standard deviation of the confirmed tracks, infinite without any.
+        """
+        return max((track.std for track in self.confirmed_tracks), default=math.inf)
+
+    def reset(self):
+        self.tracks = []
+
+    def step(self, measurements=None):
+        """
+        Advances the tracks by one frame.
+
+        Args:
+            measurements: (azimuth, confidence) pairs of this frame, or None if the networks
+                          did not run, in which case the tracks are only extrapolated
+
+        Returns:
+            The confirmed tracks, most confident first
+        """
+        for track in self.tracks:
+            track.predict()
+
+        if measurements is not None:
+            self.associate(measurements)
+
+        return sorted(self.confirmed_tracks, key=lambda track: track.confidence, reverse=True)
+
+    def associate(self, measurements):
+        strongest = []
+        for azimuth, confidence in sorted(measurements, key=lambda measurement: measurement[1], reverse=True):
+            if all(abs(wrap_angle(azimuth - other)) > self.gate for other, _ in strongest):
+                strongest.append((azimuth, confidence))
+        measurements = strongest
+
+        # Greedily pair the closest track and measurement first
+        pairs = sorted((abs(wrap_angle(azimuth - track.azimuth)), t, m)
+                       for t, track in enumerate(self.tracks)
+                       for m, (azimuth, _) in enumerate(measurements))
+        matched_tracks, matched_measurements = set(), set()
+        for distance, t, m in pairs:
+            if distance > self.gate:
+                break
+            if t in matched_tracks or m in matched_measurements:
+                continue
+            self.tracks[t].update(*measurements[m])
+            matched_tracks.add(t)
+            matched_measurements.add(m)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        # Tentative tracks are dropped as soon as they miss
+        self.tracks = [track for track in self.tracks
+                       if track.misses <= self.max_misses and (track.hits >= self.birth_hits or not track.misses)]
+
+        for m, (azimuth, confidence) in enumerate(measurements):
+            if len(self.tracks) >= self.max_tracks:
+                break
+            if m not in matched_measurements:
+                self.tracks.append(AzimuthTrack(azimuth, confidence, self.measurement_std, self.process_std))
@@ -1,18 +1,38 @@
-import pyaudio
 import numpy as np
 import math
 from itertools import combinations
+from numpy.lib.stride_tricks import sliding_window_view
 
-from pyroomacoustics.transform import stft
+import fft_backend
+
+try:
+    import pyaudio
+except ImportError:
+    # Replayed audio does not need PortAudio
+    pyaudio = None
 
 CHUNK = 4096
 RATE = 44100
 CHANNELS = 8
-FORMAT = pyaudio.paInt16
+FORMAT = pyaudio.paInt16 if pyaudio else None
 AZIMUTH_RESOLUTION = 1
 ELEVATION_RESOLUTION = 10
 UI_RESOLUTION = 10
 
+# Stream callback return codes, same values as pyaudio.paContinue and pyaudio.paComplete
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+
+# Stream callback status flag, same value as pyaudio.paInputOverflow
+PA_INPUT_OVERFLOW = 2
+
+
+def get_fft_backend():
+    """
+    FFT backend all transforms go through, see fft_backend.py.
+    """
+    return fft_backend.get_backend(CHUNK)
+
 
 def gcc_phat(x_1, x_2, interp=1):
     """
@@ -23,12 +43,12 @@ def gcc_phat(x_1, x_2, interp=1):
         A 1-D GCC vector
     """
 
-    n = len(x_1) + len(x_2) - 1
-    n += 1 if n % 2 else 0
+    n = fft_backend.next_fast_len(len(x_1) + len(x_2) - 1)
+    backend = get_fft_backend()
 
     # Fourier transforms of the two signals
-    X_1 = np.fft.rfft(x_1, n=n)
-    X_2 = np.fft.rfft(x_2, n=n)
+    X_1 = backend.rfft(x_1, n)
+    X_2 = backend.rfft(x_2, n)
 
     # Normalize by the magnitude of FFT - because PHAT
     np.divide(X_1, np.abs(X_1), X_1, where=np.abs(X_1) != 0)
@@ -37,13 +57,10 @@ def gcc_phat(x_1, x_2, interp=1):
     # GCC-PHAT = [X_1(f)X_2*(f)] / |X_1(f)X_2*(f)|
     # See http://www.xavieranguera.com/phdthesis/node92.html for reference
     CC = X_1 * np.conj(X_2)
-    cc = np.fft.irfft(CC, n=n * interp)
+    cc = backend.irfft(CC, n * interp)
 
-    # Maximum delay between a pair of microphones,
-    # expressed in a number of samples.
-    # 0.09 m is the mic array diameter and
-    # 340 m/s is assumed to be the speed of sound.
-    max_len = math.ceil(0.09 / 340 * RATE * interp)
+    # Maximum delay between a pair of microphones
+    max_len = gcc_max_len(interp)
 
     # Trim the cc vector to only include a
     # small number of samples around the origin
@@ -53,39 +70,141 @@ def gcc_phat(x_1, x_2, interp=1):
     return cc
 
 
-def compute_gcc_matrix(observation, interp=1):
+def gcc_max_len(interp=1):
     """
-    Creates a GCC matrix, where each row is a vector of GCC 
-    between a given pair of microphones.
+    Maximum delay between a pair of microphones,
+    expressed in a number of samples.
+    0.09 m is the mic array diameter and
+    340 m/s is assumed to be the speed of sound.
+    """
+    return math.ceil(0.09 / 340 * RATE * interp)
+
+
+# All 15 pairs of the 6 microphones, in the order the models were trained on
+MIC_PAIRS = np.array(list(combinations(range(6), r=2)))
+
+
+def gcc_fft_len(n_samples):
+    """
+    Length of the FFT used for GCC of two n_samples long signals,
+    rounded up to a length the FFT is fast for, 8192 for 4096 samples.
+    """
+    return fft_backend.next_fast_len(2 * n_samples - 1)
+
+
+def select_mic_channels(data, out):
+    """
+    Copies the 6 microphone channels of 8-channel device data into out, reordered to match
+    the simulated microphone array. Channels are read through strided views, without a temporary array.
     """
+    out[:, 0] = data[:, 1]
+    out[:, 1:] = data[:, -2:1:-1]
+    return out
 
-    mic_pairs = combinations(range(6), r=2)
 
-    # Initialize a transformed observation, that will be populated with GCC vectors
-    # of the observation
-    transformed_observation = []
+def compute_spectra(observation, n=None):
+    """
+    Fourier transforms of all channels at once, one row per microphone, in complex64.
+    """
+    if n is None:
+        n = gcc_fft_len(observation.shape[0])
+    return get_fft_backend().rfft(observation.astype(np.float32, copy=False), n, axis=0).T
 
-    # Compute GCC for every pair of microphones
-    for mic_1, mic_2 in mic_pairs:
-        x_1 = observation[:, mic_1]
-        x_2 = observation[:, mic_2]
 
-        gcc = gcc_phat(x_1, x_2, interp=interp)
+class GccWorkspace:
+    """
+    Preallocated buffers for computing GCC matrices with FFT length n, in float32/complex64.
+    Only the forward and inverse FFT results are allocated per frame.
+    """
 
-        # Add the GCC vector to the GCC matrix
-        transformed_observation.append(gcc)
+    def __init__(self, n=gcc_fft_len(CHUNK), interp=1):
+        self.n = n
+        self.interp = interp
+        self.max_len = gcc_max_len(interp)
+
+        n_bins = n // 2 + 1
+        self.magnitude = np.empty((6, n_bins), dtype=np.float32)
+        self.nonzero = np.empty((6, n_bins), dtype=bool)
+        self.first = np.empty((len(MIC_PAIRS), n_bins), dtype=np.complex64)
+        self.second = np.empty((len(MIC_PAIRS), n_bins), dtype=np.complex64)
+        self.first_mics = MIC_PAIRS[:, 0].copy()
+        self.second_mics = MIC_PAIRS[:, 1].copy()
+
+    def gcc_from_spectra(self, X, out=None):
+        """
+        Creates a GCC matrix from the spectra of all microphones, computed by compute_spectra
+        with FFT length n. X is PHAT-normalized in place.
+
+        Returns:
+            A (15, 2 * max_len + 1) float32 matrix, written to out if given
+        """
+
+        # Normalize by the magnitude of FFT - because PHAT
+        np.abs(X, out=self.magnitude)
+        np.not_equal(self.magnitude, 0, out=self.nonzero)
+        np.divide(X, self.magnitude, out=X, where=self.nonzero)
+
+        # Cross-spectra of every microphone pair, one row per pair.
+        # mode='clip' stops take from buffering its output, the indices are always valid
+        np.take(X, self.first_mics, axis=0, out=self.first, mode='clip')
+        np.take(X, self.second_mics, axis=0, out=self.second, mode='clip')
+        np.conjugate(self.second, out=self.second)
+        np.multiply(self.first, self.second, out=self.first)
+        cc = get_fft_backend().irfft(self.first, self.n * self.interp, axis=1, overwrite_x=True)
+
+        max_len = self.max_len
+        if out is None:
+            out = np.empty((len(MIC_PAIRS), 2 * max_len + 1), dtype=np.float32)
+
+        # Trim the cc vectors to only include a
+        # small number of samples around the origin
+        out[:, :max_len] = cc[:, -max_len:]
+        out[:, max_len:] = cc[:, :max_len + 1]
+
+        return out
+
+
+def compute_gcc_matrix(observation, interp=1, out=None, spectra=None, workspace=None):
+    """
+    Creates a GCC matrix, where each row is a vector of GCC 
+    between a given pair of microphones.
 
-    return transformed_observation
+    All channels are transformed with a single multi-channel FFT
+    and all pairs are cross-correlated with a single inverse FFT,
+    which gives the same result as calling gcc_phat for every pair.
+    Spectra of the observation that are already known can be passed in,
+    as well as a workspace to reuse between frames of the same length.
+
+    Returns:
+        A (15, 2 * max_len + 1) float32 matrix, written to out if given
+    """
+    n = gcc_fft_len(observation.shape[0])
+    if workspace is None:
+        workspace = GccWorkspace(n, interp)
+    X = compute_spectra(observation, n) if spectra is None else spectra
+    return workspace.gcc_from_spectra(X, out)
 
 
 def compute_stft_matrix(observation, nfft=256):
     """
     Creates a STFT matrix using microphone data from 6 channels.
-    """
 
+    Frames of nfft samples overlap by half and are transformed all at once, through strided views
+    of the zero-padded observation. The first frame starts nfft / 2 samples before the observation,
+    the last one covers its end, which gives the same frames as pyroomacoustics.transform.stft.analysis.
+
+    Returns:
+        A (6, nfft // 2 + 1, frames) matrix, complex64 for float32 observations
+    """
     # Default value for overlap
     step = nfft // 2
 
-    # Calculate multidimensional STFT and return
-    transformed_observation = stft.analysis(observation, L=nfft, hop=step)
-    return np.transpose(transformed_observation, axes=[2, 1, 0])
+    n_frames = -(-len(observation) // step)
+    dtype = np.float32 if observation.dtype == np.float32 else np.float64
+    padded = np.zeros(((n_frames - 1) * step + nfft, observation.shape[1]), dtype=dtype)
+    padded[nfft - step:nfft - step + len(observation)] = observation
+
+    # Frames of shape (frames, channels, nfft), without copying the samples
+    frames = sliding_window_view(padded, nfft, axis=0)[::step]
+    transformed_observation = get_fft_backend().rfft(frames, nfft, axis=2)
+    return np.transpose(transformed_observation, axes=[1, 2, 0])